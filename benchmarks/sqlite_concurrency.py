@@ -0,0 +1,88 @@
+"""Benchmark cached calls of concurrent processes sharing one SQLite database.
+
+Usage::
+
+    python benchmarks/sqlite_concurrency.py --processes 8 --calls 500
+
+Each process makes ``--calls`` cached calls cycling over ``--keys`` distinct
+arguments, so most calls are cache hits that also update the entries (writes).
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import pathlib
+import tempfile
+import time
+
+from cacholote import cache, config
+
+
+def cached_calls(
+    cache_db_urlpath: str, cache_files_urlpath: str, ncalls: int, nkeys: int
+) -> None:
+    with config.set(
+        cache_db_urlpath=cache_db_urlpath, cache_files_urlpath=cache_files_urlpath
+    ):
+        for i in range(ncalls):
+            cache.cacheable(str)(i % nkeys)
+
+
+def run(
+    nprocs: int, ncalls: int, nkeys: int, start_method: str, tmp_path: pathlib.Path
+) -> float:
+    """Return the number of cached calls per second of all processes."""
+    cache_db_urlpath = f"sqlite:///{tmp_path / 'cacholote.db'}"
+    cache_files_urlpath = str(tmp_path / "cache_files")
+    # Initialize the database upfront: only cached calls are timed
+    with config.set(cache_db_urlpath=cache_db_urlpath) as settings:
+        settings.engine.dispose()
+
+    ctx = multiprocessing.get_context(start_method)
+    args = (cache_db_urlpath, cache_files_urlpath, ncalls, nkeys)
+    processes = [
+        ctx.Process(target=cached_calls, args=args)  # type: ignore[attr-defined]
+        for _ in range(nprocs)
+    ]
+    tic = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    toc = time.perf_counter()
+    if failed := [process.exitcode for process in processes if process.exitcode]:
+        raise RuntimeError(f"{len(failed)} processes failed: {failed=}")
+    return nprocs * ncalls / (toc - tic)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--keys", type=int, default=10)
+    parser.add_argument(
+        "--start-method",
+        choices=multiprocessing.get_all_start_methods(),
+        default="fork" if "fork" in multiprocessing.get_all_start_methods() else None,
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for i in range(args.repeat):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            calls_per_second = run(
+                args.processes,
+                args.calls,
+                args.keys,
+                args.start_method,
+                pathlib.Path(tmpdir),
+            )
+        print(
+            f"run {i}: {args.processes} processes x {args.calls} calls:"
+            f" {calls_per_second:,.0f} calls/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
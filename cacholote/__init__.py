@@ -15,7 +15,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from . import config, database, extra_encoders, utils
+from . import (
+    bloom,
+    breaker,
+    config,
+    database,
+    extra_encoders,
+    hot_cache,
+    stores,
+    utils,
+)
 from .cache import cacheable
 from .clean import (
     clean_cache_files,
@@ -39,6 +48,8 @@ extra_encoders.register_all()
 
 __all__ = [
     "__version__",
+    "bloom",
+    "breaker",
     "cacheable",
     "clean_cache_files",
     "clean_invalid_cache_entries",
@@ -48,7 +59,9 @@ __all__ = [
     "dumps",
     "expire_cache_entries",
     "extra_encoders",
+    "hot_cache",
     "init_database",
     "loads",
+    "stores",
     "utils",
 ]
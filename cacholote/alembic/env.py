@@ -40,8 +40,14 @@ def run_migrations_online() -> None:
 
     In this scenario we need to create an Engine
     and associate a connection with the context.
+    An existing connection can be shared via ``config.attributes["connection"]``.
 
     """
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run_migrations(connection)
+        return
+
     url_props = dict()
     for prop in ["drivername", "username", "password", "host", "port", "database"]:
         url_props[prop] = config.get_main_option(prop)
@@ -49,14 +55,18 @@ def run_migrations_online() -> None:
     url = sa.engine.URL.create(**url_props)  # type: ignore
     engine = sa.create_engine(url, poolclass=sa.pool.NullPool)
     with engine.connect() as connection:
-        alembic.context.configure(
-            connection=connection,
-            target_metadata=cacholote.database.Base.metadata,
-            version_table="alembic_version_cacholote",
-        )
-
-        with alembic.context.begin_transaction():
-            alembic.context.run_migrations()
+        _run_migrations(connection)
+
+
+def _run_migrations(connection: sa.Connection) -> None:
+    alembic.context.configure(
+        connection=connection,
+        target_metadata=cacholote.database.Base.metadata,
+        version_table="alembic_version_cacholote",
+    )
+
+    with alembic.context.begin_transaction():
+        alembic.context.run_migrations()
 
 
 if alembic.context.is_offline_mode():
@@ -0,0 +1,49 @@
+"""add cache_files table.
+
+Revision ID: 5c1b0e2f7d94
+Revises: a38663d192e5
+Create Date: 2026-10-19 10:12:31.418207
+
+"""
+
+import collections
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+import cacholote
+
+# revision identifiers, used by Alembic.
+revision: str = "5c1b0e2f7d94"
+down_revision: Union[str, None] = "a38663d192e5"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    cache_files = op.create_table(
+        "cache_files",
+        sa.Column("local_path", sa.String, primary_key=True),
+        sa.Column("refcount", sa.Integer, nullable=False, default=0),
+    )
+
+    # Count the references of existing cache entries
+    cache_entries = sa.table("cache_entries", sa.column("result", sa.JSON))
+    counter: collections.Counter[str] = collections.Counter()
+    for result in op.get_bind().scalars(
+        sa.select(cache_entries.c.result).execution_options(yield_per=10_000)
+    ):
+        counter.update(cacholote.database._count_file_references(result))
+    if counter:
+        op.bulk_insert(
+            cache_files,
+            [
+                {"local_path": local_path, "refcount": refcount}
+                for local_path, refcount in counter.items()
+            ],
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("cache_files")
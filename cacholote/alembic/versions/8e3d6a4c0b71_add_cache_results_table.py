@@ -0,0 +1,53 @@
+"""add cache_results table.
+
+Revision ID: 8e3d6a4c0b71
+Revises: 5c1b0e2f7d94
+Create Date: 2026-10-19 15:47:09.203514
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8e3d6a4c0b71"
+down_revision: Union[str, None] = "5c1b0e2f7d94"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "cache_results",
+        sa.Column("digest", sa.String(32), primary_key=True),
+        sa.Column("result", sa.JSON),
+        sa.Column("refcount", sa.Integer, nullable=False, default=0),
+    )
+    op.add_column("cache_entries", sa.Column("result_digest", sa.String(32)))
+
+
+def downgrade() -> None:
+    # Restore the results of entries sharing results
+    cache_entries = sa.table(
+        "cache_entries",
+        sa.column("result", sa.JSON),
+        sa.column("result_digest", sa.String(32)),
+    )
+    cache_results = sa.table(
+        "cache_results",
+        sa.column("digest", sa.String(32)),
+        sa.column("result", sa.JSON),
+    )
+    op.execute(
+        cache_entries.update()
+        .where(cache_entries.c.result_digest.is_not(None))
+        .values(
+            result=sa.select(cache_results.c.result)
+            .where(cache_results.c.digest == cache_entries.c.result_digest)
+            .scalar_subquery()
+        )
+    )
+    op.drop_column("cache_entries", "result_digest")
+    op.drop_table("cache_results")
@@ -0,0 +1,323 @@
+"""Bloom filter of live cache keys shared between processes."""
+
+# Copyright 2023, European Union.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+
+import datetime
+import functools
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from typing import Callable, Optional
+
+import sqlalchemy as sa
+
+from . import config, database, utils
+
+_MAGIC = b"CACHOBF1"
+# magic, number of bits, number of hashes, build timestamp, superseded flag
+_HEADER = struct.Struct("<8sQQdB")
+_HEADER_SIZE = 64
+_SUPERSEDED_OFFSET = 32
+# Timestamp of the last merge of keys created by other nodes
+_SYNCED_AT = struct.Struct("<d")
+_SYNCED_AT_OFFSET = 40
+_ERROR_RATE = 0.01
+_MIN_CAPACITY = 1_000_000
+# Tolerate clock skew between hosts writing entries
+_REBUILD_OVERLAP = datetime.timedelta(minutes=1)
+# Number of keys fetched at a time when building filters
+_YIELD_PER = 10_000
+_BUILD_LOCK = threading.Lock()
+_BUILD_THREAD: threading.Thread | None = None
+
+
+def _get_indices(key: str, n_bits: int, n_hashes: int) -> Iterator[int]:
+    # Keys are uniformly distributed hex digests: double hashing of their halves
+    h1 = int(key[:16], 16)
+    h2 = int(key[16:32] or "1", 16) | 1
+    for i in range(n_hashes):
+        yield (h1 + i * h2) % n_bits
+
+
+class BloomFilter:
+    """Bloom filter stored in a memory-mapped file.
+
+    Membership tests never miss keys added to the filter (no false negatives),
+    but might report keys that have never been added (false positives).
+    Rebuilt filters atomically replace the file, and processes using the old
+    file reopen it on their next access. Keys created elsewhere since the last
+    build or refresh are merged by refreshes.
+
+    Parameters
+    ----------
+    path: str, PathLike
+        Path of the filter file.
+    """
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        self.path = os.fspath(path)
+        self.lockfile = self.path + ".lock"
+        self._mmap: mmap.mmap | None = None
+
+    def _get_mmap(self) -> mmap.mmap | None:
+        mm = self._mmap
+        if mm is None or mm[_SUPERSEDED_OFFSET]:
+            try:
+                with open(self.path, "r+b") as f:
+                    mm = mmap.mmap(f.fileno(), 0)
+            except FileNotFoundError:
+                return None
+            self._mmap = mm
+        return mm
+
+    def _get_header(self, mm: mmap.mmap) -> tuple[int, int, float]:
+        magic, n_bits, n_hashes, built_at, _ = _HEADER.unpack_from(mm)
+        if magic != _MAGIC:
+            raise ValueError(f"{self.path!r} is not a cacholote bloom filter.")
+        return n_bits, n_hashes, built_at
+
+    @property
+    def built_at(self) -> float | None:
+        """Timestamp of the last build, None if the filter does not exist."""
+        mm = self._get_mmap()
+        return None if mm is None else self._get_header(mm)[2]
+
+    @property
+    def synced_at(self) -> float | None:
+        """Timestamp of the last build or refresh, None if the filter does not exist."""
+        mm = self._get_mmap()
+        if mm is None:
+            return None
+        synced_at: float = _SYNCED_AT.unpack_from(mm, _SYNCED_AT_OFFSET)[0]
+        # Filters built by older versions were never refreshed
+        return max(synced_at, self._get_header(mm)[2])
+
+    def __contains__(self, key: str) -> bool:
+        mm = self._get_mmap()
+        if mm is None:
+            # Unknown: fall through to the database
+            return True
+        n_bits, n_hashes, _ = self._get_header(mm)
+        return all(
+            mm[_HEADER_SIZE + (index >> 3)] & (1 << (index & 7))
+            for index in _get_indices(key, n_bits, n_hashes)
+        )
+
+    def add(self, *keys: str) -> None:
+        with utils._flock(self.lockfile):
+            mm = self._get_mmap()
+            if mm is None:
+                return
+            n_bits, n_hashes, _ = self._get_header(mm)
+            for key in keys:
+                for index in _get_indices(key, n_bits, n_hashes):
+                    mm[_HEADER_SIZE + (index >> 3)] |= 1 << (index & 7)
+
+    def build(
+        self,
+        get_keys: Callable[[Optional[datetime.datetime]], Iterable[str]],
+        capacity: int = _MIN_CAPACITY,
+    ) -> None:
+        """Build the filter from scratch and replace the existing one.
+
+        Parameters
+        ----------
+        get_keys: callable
+            Return live keys, optionally only those created after a datetime.
+            All keys are retrieved without blocking concurrent updates, then keys
+            created during the build are added while updates are blocked.
+        capacity: int
+            Number of keys the filter is sized for.
+        """
+        started_at = utils.utcnow()
+        n_bits = math.ceil(-capacity * math.log(_ERROR_RATE) / math.log(2) ** 2)
+        n_hashes = max(1, round(n_bits / capacity * math.log(2)))
+        bits = bytearray(math.ceil(n_bits / 8))
+        for key in get_keys(None):
+            for index in _get_indices(key, n_bits, n_hashes):
+                bits[index >> 3] |= 1 << (index & 7)
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with utils._flock(self.lockfile):
+            synced_at = time.time()
+            for key in get_keys(started_at - _REBUILD_OVERLAP):
+                for index in _get_indices(key, n_bits, n_hashes):
+                    bits[index >> 3] |= 1 << (index & 7)
+            with open(tmp_path, "wb") as f:
+                header = bytearray(_HEADER_SIZE)
+                _HEADER.pack_into(header, 0, _MAGIC, n_bits, n_hashes, synced_at, 0)
+                _SYNCED_AT.pack_into(header, _SYNCED_AT_OFFSET, synced_at)
+                f.write(header)
+                f.write(bits)
+            old_mm = self._get_mmap()
+            os.replace(tmp_path, self.path)
+            if old_mm is not None:
+                old_mm[_SUPERSEDED_OFFSET] = 1
+        self._mmap = None
+
+    def refresh(
+        self, get_keys: Callable[[Optional[datetime.datetime]], Iterable[str]]
+    ) -> None:
+        """Add the keys created since the last build or refresh.
+
+        Parameters
+        ----------
+        get_keys: callable
+            Return live keys created after a datetime.
+        """
+        if (synced_at := self.synced_at) is None:
+            return
+        refreshed_at = time.time()
+        created_after = (
+            datetime.datetime.fromtimestamp(synced_at, tz=datetime.timezone.utc)
+            - _REBUILD_OVERLAP
+        )
+        keys = list(get_keys(created_after))
+        with utils._flock(self.lockfile):
+            mm = self._get_mmap()
+            if mm is None:
+                return
+            n_bits, n_hashes, _ = self._get_header(mm)
+            for key in keys:
+                for index in _get_indices(key, n_bits, n_hashes):
+                    mm[_HEADER_SIZE + (index >> 3)] |= 1 << (index & 7)
+            if refreshed_at > _SYNCED_AT.unpack_from(mm, _SYNCED_AT_OFFSET)[0]:
+                _SYNCED_AT.pack_into(mm, _SYNCED_AT_OFFSET, refreshed_at)
+
+    def is_stale(self, interval: float) -> bool:
+        built_at = self.built_at
+        return built_at is None or time.time() - built_at >= interval
+
+    def is_refresh_due(self, interval: float) -> bool:
+        synced_at = self.synced_at
+        return synced_at is not None and time.time() - synced_at >= interval
+
+
+def _get_live_keys(
+    settings: config.Settings, created_after: datetime.datetime | None = None
+) -> Iterator[str]:
+    now = utils.utcnow()
+    if (store := settings.metadata_store) is not None:
+        # Entries of stores have naive UTC datetimes
+        naive_now = now.replace(tzinfo=None)
+        if created_after is None:
+            cache_entries = store.iter_entries()
+        else:
+            # Entries are updated when they are created
+            created_after = created_after.replace(tzinfo=None)
+            cache_entries = store.iter_updated_entries(created_after)
+        for cache_entry in cache_entries:
+            if (
+                cache_entry.key is not None
+                and (
+                    cache_entry.expiration is None or cache_entry.expiration > naive_now
+                )
+                and (
+                    created_after is None
+                    or cache_entry.created_at is None
+                    or cache_entry.created_at >= created_after
+                )
+            ):
+                yield cache_entry.key
+        return
+
+    stmt = (
+        sa.select(database.CacheEntry.key)
+        .filter(database.CacheEntry.expiration > now)
+        .distinct()
+        .execution_options(yield_per=_YIELD_PER)
+    )
+    if created_after is not None:
+        stmt = stmt.filter(database.CacheEntry.created_at >= created_after)
+    # Replicas might lag behind: use the primary databases
+    for sessionmaker in settings.instantiated_sessionmakers:
+        with sessionmaker() as session:
+            yield from (
+                live_key for live_key in session.scalars(stmt) if live_key is not None
+            )
+
+
+def _count_live_keys(settings: config.Settings) -> int:
+    if settings.metadata_store is not None:
+        return sum(1 for _ in _get_live_keys(settings))
+    stmt = sa.select(sa.func.count(sa.distinct(database.CacheEntry.key))).filter(
+        database.CacheEntry.expiration > utils.utcnow()
+    )
+    count = 0
+    for sessionmaker in settings.instantiated_sessionmakers:
+        with sessionmaker() as session:
+            count += session.scalar(stmt) or 0
+    return count
+
+
+def _build(bloom_filter: BloomFilter, settings: config.Settings) -> None:
+    try:
+        # Only one process rebuilds the filter, the others keep using the old one
+        with utils._flock(bloom_filter.path + ".build", blocking=False) as acquired:
+            if acquired and bloom_filter.is_stale(
+                settings.bloom_filter_rebuild_interval
+            ):
+                bloom_filter.build(
+                    functools.partial(_get_live_keys, settings),
+                    capacity=max(_MIN_CAPACITY, 2 * _count_live_keys(settings)),
+                )
+            elif acquired and bloom_filter.is_refresh_due(
+                settings.bloom_filter_refresh_interval
+            ):
+                bloom_filter.refresh(functools.partial(_get_live_keys, settings))
+    except Exception as ex:
+        settings.logger.warning("can NOT build bloom filter", error=repr(ex))
+    finally:
+        _BUILD_LOCK.release()
+
+
+@functools.lru_cache()
+def _get_bloom_filter(path: str) -> BloomFilter:
+    return BloomFilter(path)
+
+
+def get_bloom_filter(settings: config.Settings) -> BloomFilter | None:
+    """Return the bloom filter of live keys, rebuilding or refreshing it in background."""
+    global _BUILD_THREAD
+    if settings.bloom_filter_path is None:
+        return None
+    bloom_filter = _get_bloom_filter(settings.bloom_filter_path)
+    if (
+        bloom_filter.is_stale(settings.bloom_filter_rebuild_interval)
+        or bloom_filter.is_refresh_due(settings.bloom_filter_refresh_interval)
+    ) and _BUILD_LOCK.acquire(blocking=False):
+        _BUILD_THREAD = threading.Thread(
+            target=_build,
+            args=(bloom_filter, settings),
+            name="cacholote-bloom",
+            daemon=True,
+        )
+        _BUILD_THREAD.start()
+    return bloom_filter
+
+
+def is_definite_miss(settings: config.Settings, key: str) -> bool:
+    """Whether a key is NOT cached, skipping lookups of the cache database.
+
+    Keys cached by other nodes are missed until the next refresh of the filter
+    (i.e., up to ``bloom_filter_refresh_interval`` seconds).
+    """
+    bloom_filter = get_bloom_filter(settings)
+    return bloom_filter is not None and key not in bloom_filter
@@ -0,0 +1,163 @@
+"""Latency budgets and circuit breakers for cache backends."""
+
+# Copyright 2023, European Union.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+
+import concurrent.futures
+import contextvars
+import os
+import threading
+import time
+from typing import Any, Callable, TypeVar
+
+from . import config, database
+
+R = TypeVar("R")
+
+_MAX_WORKERS = 32
+_EXECUTOR: concurrent.futures.ThreadPoolExecutor | None = None
+_IN_FLIGHT: threading.BoundedSemaphore | None = None
+_EXECUTOR_PID: int | None = None
+_CIRCUIT_BREAKERS: dict[tuple[str, int, float], CircuitBreaker] = {}
+_LOCK = threading.Lock()
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """Stop contacting a backend that keeps exceeding its latency budget.
+
+    The circuit opens after ``threshold`` consecutive failures. Once ``cooldown``
+    seconds have passed, a single trial call is allowed: the circuit closes if the
+    trial succeeds, and opens again otherwise.
+    """
+
+    def __init__(self, threshold: int, cooldown: float) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+def get_circuit_breaker(settings: config.Settings) -> CircuitBreaker:
+    """Return the circuit breaker of the cache database."""
+    key = (
+        str(settings.cache_db_urlpath),
+        settings.circuit_breaker_threshold,
+        settings.circuit_breaker_cooldown,
+    )
+    with _LOCK:
+        if key not in _CIRCUIT_BREAKERS:
+            _CIRCUIT_BREAKERS[key] = CircuitBreaker(*key[1:])
+        return _CIRCUIT_BREAKERS[key]
+
+
+def _get_executor() -> tuple[
+    concurrent.futures.ThreadPoolExecutor, threading.BoundedSemaphore
+]:
+    global _EXECUTOR, _EXECUTOR_PID, _IN_FLIGHT
+    with _LOCK:
+        if _EXECUTOR is None or _IN_FLIGHT is None or _EXECUTOR_PID != os.getpid():
+            # Threads are NOT inherited by forked processes
+            _EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                max_workers=_MAX_WORKERS, thread_name_prefix="cacholote"
+            )
+            _IN_FLIGHT = threading.BoundedSemaphore(_MAX_WORKERS)
+            _EXECUTOR_PID = os.getpid()
+        return _EXECUTOR, _IN_FLIGHT
+
+
+def run_with_timeout(
+    func: Callable[..., R], timeout: float, *args: Any, **kwargs: Any
+) -> R:
+    """Call ``func`` in a worker thread, raise ``TimeoutError`` if it is too slow.
+
+    Calls exceeding the timeout are NOT interrupted, but statements of the cache
+    database issued after the timeout are cancelled (PostgreSQL ``statement_timeout``
+    and SQLite busy timeout are sized to the time left).
+    Calls are NOT queued: ``TimeoutError`` is raised without calling ``func`` if all
+    workers are busy (e.g., with calls that exceeded the timeout).
+    """
+    executor, in_flight = _get_executor()
+    if not in_flight.acquire(blocking=False):
+        raise TimeoutError(f"{_MAX_WORKERS} calls exceeding the timeout are running")
+    context = contextvars.copy_context()
+    context.run(database._STATEMENT_DEADLINE.set, time.monotonic() + timeout)
+    try:
+        future = executor.submit(context.run, func, *args, **kwargs)
+    except BaseException:
+        in_flight.release()
+        raise
+    future.add_done_callback(lambda _: in_flight.release())
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        raise TimeoutError(f"{func.__name__!r} exceeded {timeout=}s") from None
+
+
+def call_within_budget(
+    func: Callable[..., R], settings: config.Settings, *args: Any, **kwargs: Any
+) -> R:
+    """Call ``func`` within ``settings.lookup_timeout``, tracking the backend health.
+
+    Raise ``CircuitOpenError`` without calling ``func`` if the backend is unhealthy.
+    """
+    if settings.lookup_timeout is None:
+        return func(*args, **kwargs)
+
+    circuit_breaker = get_circuit_breaker(settings)
+    if not circuit_breaker.allow():
+        raise CircuitOpenError("the cache database keeps exceeding `lookup_timeout`")
+    try:
+        result = run_with_timeout(func, settings.lookup_timeout, *args, **kwargs)
+    except LookupError:
+        # The backend did respond
+        circuit_breaker.record_success()
+        raise
+    except Exception:
+        circuit_breaker.record_failure()
+        raise
+    circuit_breaker.record_success()
+    return result
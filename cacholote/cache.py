@@ -16,33 +16,111 @@
 # limitations under the License.
 from __future__ import annotations
 
+import collections
+import datetime
 import functools
 import json
+import threading
 import warnings
 from typing import Any, Callable, TypeVar, cast
 
-import sqlalchemy as sa
-import sqlalchemy.orm
-
-from . import clean, config, database, decode, encode, utils
+from . import bloom, breaker, clean, config, database, decode, encode, hot_cache
 
 F = TypeVar("F", bound=Callable[..., Any])
 
+# Results served when the cache database is too slow: key -> (expiration, result)
+_LAST_KNOWN_GOOD: collections.OrderedDict[str, tuple[datetime.datetime, str]] = (
+    collections.OrderedDict()
+)
+_LAST_KNOWN_GOOD_LOCK = threading.Lock()
+
 
-def _decode_and_update(
-    session: sa.orm.Session,
-    cache_entry: Any,
+def _remember_result(
+    hexdigest: str,
+    expiration: datetime.datetime,
+    result_as_string: str,
     settings: config.Settings,
-) -> Any:
-    result = decode.loads(cache_entry._result_as_string)
-    cache_entry.counter = (cache_entry.counter or 0) + 1
-    if settings.tag is not None:
-        cache_entry.tag = settings.tag
-    database._commit_or_rollback(session)
-    if settings.return_cache_entry:
-        session.refresh(cache_entry)
-        return cache_entry
-    return result
+) -> None:
+    if settings.lookup_timeout is None or not settings.last_known_good_size:
+        return
+    with _LAST_KNOWN_GOOD_LOCK:
+        _LAST_KNOWN_GOOD[hexdigest] = (expiration, result_as_string)
+        _LAST_KNOWN_GOOD.move_to_end(hexdigest)
+        while len(_LAST_KNOWN_GOOD) > settings.last_known_good_size:
+            _LAST_KNOWN_GOOD.popitem(last=False)
+
+
+def _get_last_known_good_result(hexdigest: str, settings: config.Settings) -> Any:
+    """Return decoded results remembered by this process.
+
+    Raise ``LookupError`` if there are no valid results.
+    """
+    with _LAST_KNOWN_GOOD_LOCK:
+        expiration, result_as_string = _LAST_KNOWN_GOOD[hexdigest]
+    # Remembered expirations are naive UTC
+    now = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+    if expiration <= now or (
+        settings.expiration is not None
+        and expiration
+        != settings.expiration.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    ):
+        raise LookupError(hexdigest)
+    try:
+        return decode.loads(result_as_string)
+    except decode.DecodeError:
+        raise LookupError(hexdigest)
+
+
+def _get_cache_entry_result(hexdigest: str, settings: config.Settings) -> Any:
+    """Return decoded results and update the first valid cache entry.
+
+    Raise ``LookupError`` if there are no valid cache entries.
+    """
+    hot = hot_cache.get_hot_cache(settings)
+    if hot is not None and (settings.tag is not None or settings.return_cache_entry):
+        # Hot hits do not update cache entries
+        hot = None
+    if hot is not None:
+        result_as_string = hot.get(hexdigest, expiration=settings.expiration)
+        if result_as_string is not None:
+            hot_cache.flush_hits_in_background(hot, settings)
+            try:
+                return decode.loads(result_as_string)
+            except decode.DecodeError:
+                hot.discard(hexdigest)
+
+    if bloom.is_definite_miss(settings, hexdigest):
+        raise LookupError(hexdigest)
+
+    store = settings.get_metadata_store(hexdigest)
+    for entry_id, entry_expiration, result_as_string in store.get_results(
+        hexdigest, expiration=settings.expiration
+    ):
+        try:
+            result = decode.loads(result_as_string)
+        except decode.DecodeError as ex:
+            warnings.warn(str(ex), UserWarning)
+            if cache_entry := store.get_entry(entry_id):
+                clean._delete_store_entries(store, cache_entry)
+            continue
+
+        if not store.touch_entry(entry_id, tag=settings.tag):
+            # Stale entry (e.g., from a replica): it has been deleted
+            continue
+
+        if hot is not None:
+            for key, hot_entry_id, hits in hot.put(
+                hexdigest, entry_id, entry_expiration, result_as_string
+            ):
+                settings.get_metadata_store(key).touch_entry(hot_entry_id, count=hits)
+
+        _remember_result(hexdigest, entry_expiration, result_as_string, settings)
+
+        if settings.return_cache_entry:
+            return store.get_entry(entry_id)
+        return result
+
+    raise LookupError(hexdigest)
 
 
 def cacheable(func: F, **cache_kwargs: Any) -> F:
@@ -79,42 +157,53 @@ def cacheable(func: F, **cache_kwargs: Any) -> F:
             return func(*args, **kwargs)
 
         if settings.use_cache:
-            filters = [
-                database.CacheEntry.key == hexdigest,
-                database.CacheEntry.expiration > utils.utcnow(),
-            ]
-            if settings.expiration:
-                # When expiration is provided, only get entries with matching expiration
-                filters.append(database.CacheEntry.expiration == settings.expiration)
-
-            with settings.instantiated_sessionmaker() as session:
-                for cache_entry in session.scalars(
-                    sa.select(database.CacheEntry)
-                    .filter(*filters)
-                    .order_by(database.CacheEntry.updated_at.desc())
-                ):
-                    try:
-                        return _decode_and_update(session, cache_entry, settings)
-                    except decode.DecodeError as ex:
-                        warnings.warn(str(ex), UserWarning)
-                        clean._delete_cache_entries(session, cache_entry)
+            try:
+                return breaker.call_within_budget(
+                    _get_cache_entry_result, settings, hexdigest, settings
+                )
+            except LookupError:
+                pass
+            except Exception as ex:
+                # Slow or failing cache database
+                if settings.lookup_timeout is None or settings.return_cache_entry:
+                    raise ex
+                settings.logger.warning("bypassing cache", reason=str(ex))
+                try:
+                    return _get_last_known_good_result(hexdigest, settings)
+                except LookupError:
+                    return func(*args, **kwargs)
 
         result = func(*args, **kwargs)
         cache_entry = database.CacheEntry(
             key=hexdigest,
             expiration=settings.expiration,
             tag=settings.tag,
+            counter=1,
         )
         try:
-            cache_entry.result = json.loads(encode.dumps(result))
+            with encode._set_hexdigest(hexdigest):
+                cache_entry.result = json.loads(encode.dumps(result))
         except encode.EncodeError as ex:
             if settings.return_cache_entry:
                 raise ex
             warnings.warn(f"can NOT encode output: {ex!r}", UserWarning)
             return result
 
-        with settings.instantiated_sessionmaker() as session:
-            session.add(cache_entry)
-            return _decode_and_update(session, cache_entry, settings)
+        result = decode.loads(cache_entry._result_as_string)
+        store = settings.get_metadata_store(hexdigest)
+        try:
+            entry_id = breaker.call_within_budget(
+                store.add_entry, settings, cache_entry
+            )
+        except Exception as ex:
+            if settings.lookup_timeout is None or settings.return_cache_entry:
+                raise ex
+            settings.logger.warning("bypassing cache", reason=str(ex))
+            return result
+        if (bloom_filter := bloom.get_bloom_filter(settings)) is not None:
+            bloom_filter.add(hexdigest)
+        if settings.return_cache_entry:
+            return store.get_entry(entry_id)
+        return result
 
     return cast(F, wrapper)
@@ -16,10 +16,17 @@
 from __future__ import annotations
 
 import collections
+import concurrent.futures
+import contextlib
+import contextvars
 import datetime
+import functools
+import heapq
+import itertools
 import posixpath
 import time
-from typing import Any, Callable, Literal, Optional
+from collections.abc import Iterable, Sequence
+from typing import Any, Callable, Literal, Optional, TypeVar
 
 import fsspec
 import pydantic
@@ -27,15 +34,38 @@ import sqlalchemy as sa
 import sqlalchemy.orm
 from sqlalchemy import BinaryExpression, ColumnElement
 
-from . import config, database, decode, encode, extra_encoders, utils
-
-FILE_RESULT_KEYS = ("type", "callable", "args", "kwargs")
-FILE_RESULT_CALLABLES = (
-    "cacholote.extra_encoders:decode_xr_dataarray",
-    "cacholote.extra_encoders:decode_xr_dataset",
-    "cacholote.extra_encoders:decode_io_object",
+from . import (
+    config,
+    database,
+    decode,
+    encode,
+    extra_encoders,
+    hot_cache,
+    stores,
+    utils,
 )
 
+T = TypeVar("T")
+R = TypeVar("R")
+
+FILE_RESULT_KEYS = database.FILE_RESULT_KEYS
+FILE_RESULT_CALLABLES = database.FILE_RESULT_CALLABLES
+
+# Number of cache entries fetched at a time when scanning shards
+_YIELD_PER = 1_000
+
+
+def _fan_out(func: Callable[[T], R], items: Sequence[T]) -> list[R]:
+    """Apply ``func`` to each item (e.g., database shard) in parallel."""
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    with concurrent.futures.ThreadPoolExecutor(len(items)) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, func, item)
+            for item in items
+        ]
+        return [future.result() for future in futures]
+
 
 def _get_files_from_cache_entry(
     cache_entry: database.CacheEntry, key: str | None
@@ -51,11 +81,21 @@ def _get_files_from_cache_entry(
             and set(FILE_RESULT_KEYS) == set(obj)
             and obj["callable"] in FILE_RESULT_CALLABLES
         ):
-            fs, urlpath = extra_encoders._get_fs_and_urlpath(*obj["args"][:2])
-            value = obj["args"][0]
-            if key is not None:
-                value = value[key]
-            files[fs.unstrip_protocol(urlpath)] = value
+            file_json, storage_options = obj["args"][:2]
+            # Reference indexes are stored next to cache files
+            for file_or_references_json in (
+                file_json,
+                file_json.get("file:references"),
+            ):
+                if file_or_references_json is None:
+                    continue
+                fs, urlpath = extra_encoders._get_fs_and_urlpath(
+                    file_or_references_json, storage_options
+                )
+                value = file_or_references_json
+                if key is not None:
+                    value = value[key]
+                files[fs.unstrip_protocol(urlpath)] = value
     return files
 
 
@@ -84,25 +124,87 @@ def _remove_files(
             files = [file for file in files if fs.exists(file)]
 
 
-def _delete_cache_entries(
-    session: sa.orm.Session, *cache_entries: database.CacheEntry
+def _remove_cache_entries_files(
+    *cache_entries: database.CacheEntry,
+    get_referenced_files: Callable[..., set[str]] | None = None,
 ) -> None:
     fs, _ = utils.get_cache_files_fs_dirname()
+    files = {}
+    for cache_entry in cache_entries:
+        files.update(_get_files_from_cache_entry(cache_entry, key=None))
+
+    if get_referenced_files is not None:
+        # Cache files shared with other entries are NOT removed
+        referenced_files = get_referenced_files(
+            *[file_json["file:local_path"] for file_json in files.values()]
+        )
+        files = {
+            file: file_json
+            for file, file_json in files.items()
+            if file_json["file:local_path"] not in referenced_files
+        }
+
     files_to_delete = []
     dirs_to_delete = []
+    for file, file_json in files.items():
+        if file_json["type"] == "application/vnd+zarr":
+            dirs_to_delete.append(file)
+        else:
+            files_to_delete.append(file)
+
+    _remove_files(fs, files_to_delete, recursive=False)
+    _remove_files(fs, dirs_to_delete, recursive=True)
+
+
+def _invalidate_local_entries(*cache_entries: database.CacheEntry) -> None:
+    """Drop entries from the node-local index and hot cache.
+
+    Other nodes drop them on sync and hot cache revalidation.
+    """
+    settings = config.get()
+    entry_ids = _get_entry_ids(*cache_entries)
+    if (path := settings.cache_db_local_path) is not None and entry_ids:
+        stores._get_sqlite_store(path).delete_entries(*entry_ids)
+    if (hot := hot_cache.get_hot_cache(settings)) is not None:
+        for key in {cache_entry.key for cache_entry in cache_entries}:
+            if key is not None:
+                hot.discard(key)
+
+
+def _delete_cache_entries(
+    session: sa.orm.Session, *cache_entries: database.CacheEntry
+) -> None:
     for cache_entry in cache_entries:
         session.delete(cache_entry)
-
-        files = _get_files_from_cache_entry(cache_entry, key="type")
-        for file, file_type in files.items():
-            if file_type == "application/vnd+zarr":
-                dirs_to_delete.append(file)
-            else:
-                files_to_delete.append(file)
+    database._remove_file_references(
+        session, *[cache_entry.result for cache_entry in cache_entries]
+    )
+    database._remove_result_references(
+        session, *[cache_entry.result_digest for cache_entry in cache_entries]
+    )
     database._commit_or_rollback(session)
+    _invalidate_local_entries(*cache_entries)
+    _remove_cache_entries_files(
+        *cache_entries,
+        get_referenced_files=functools.partial(database._get_referenced_files, session),
+    )
 
-    _remove_files(fs, files_to_delete, recursive=False)
-    _remove_files(fs, dirs_to_delete, recursive=True)
+
+def _get_entry_ids(*cache_entries: database.CacheEntry) -> list[int]:
+    return [
+        cache_entry.id for cache_entry in cache_entries if cache_entry.id is not None
+    ]
+
+
+def _delete_store_entries(
+    store: stores.MetadataStore, *cache_entries: database.CacheEntry
+) -> None:
+    if cache_entries:
+        store.delete_entries(*_get_entry_ids(*cache_entries))
+        _invalidate_local_entries(*cache_entries)
+    _remove_cache_entries_files(
+        *cache_entries, get_referenced_files=store.get_referenced_files
+    )
 
 
 def delete(func_to_del: str | Callable[..., Any], *args: Any, **kwargs: Any) -> None:
@@ -118,11 +220,11 @@ def delete(func_to_del: str | Callable[..., Any], *args: Any, **kwargs: Any) ->
         Keyword arguments of functions to delete from cache
     """
     hexdigest = encode._hexdigestify_python_call(func_to_del, *args, **kwargs)
-    with config.get().instantiated_sessionmaker() as session:
-        for cache_entry in session.scalars(
-            sa.select(database.CacheEntry).filter(database.CacheEntry.key == hexdigest)
-        ):
-            _delete_cache_entries(session, cache_entry)
+    settings = config.get()
+    if (hot := hot_cache.get_hot_cache(settings)) is not None:
+        hot.discard(hexdigest)
+    store = settings.get_metadata_store(hexdigest)
+    _delete_store_entries(store, *store.iter_entries(key=hexdigest))
 
 
 class _Cleaner:
@@ -134,7 +236,11 @@ class _Cleaner:
 
         self.logger.info("getting disk usage")
         self.file_sizes: dict[str, int] = collections.defaultdict(int)
-        du = self.known_files if use_database else self.fs.du(self.dirname, total=False)
+        du = (
+            self.get_known_files(readonly=True)
+            if use_database
+            else self.fs.du(self.dirname, total=False)
+        )
         for path, size in du.items():
             # Group dirs
             urlpath = self.fs.unstrip_protocol(path)
@@ -155,15 +261,39 @@ class _Cleaner:
     def stop_cleaning(self, maxsize: int) -> bool:
         return self.disk_usage <= maxsize
 
-    @property
-    def known_files(self) -> dict[str, int]:
+    def _get_known_files(
+        self, cache_entries: Iterable[database.CacheEntry]
+    ) -> dict[str, int]:
         known_files: dict[str, int] = {}
-        with config.get().instantiated_sessionmaker() as session:
-            for cache_entry in session.scalars(sa.select(database.CacheEntry)):
-                files = _get_files_from_cache_entry(cache_entry, key="file:size")
-                known_files.update(
-                    {k: v for k, v in files.items() if k.startswith(self.urldir)}
+        for cache_entry in cache_entries:
+            files = _get_files_from_cache_entry(cache_entry, key="file:size")
+            known_files.update(
+                {k: v for k, v in files.items() if k.startswith(self.urldir)}
+            )
+        return known_files
+
+    def get_known_files(self, readonly: bool) -> dict[str, int]:
+        settings = config.get()
+        if settings.metadata_store is not None:
+            return self._get_known_files(settings.metadata_store.iter_entries())
+
+        sessionmakers = (
+            settings.instantiated_readonly_sessionmakers
+            if readonly
+            else settings.instantiated_sessionmakers
+        )
+
+        def get_shard_known_files(
+            sessionmaker: sa.orm.sessionmaker[sa.orm.Session],
+        ) -> dict[str, int]:
+            with sessionmaker() as session:
+                return self._get_known_files(
+                    session.scalars(sa.select(database.CacheEntry))
                 )
+
+        known_files: dict[str, int] = {}
+        for shard_known_files in _fan_out(get_shard_known_files, sessionmakers):
+            known_files.update(shard_known_files)
         return known_files
 
     def get_unknown_files(self, lock_validity_period: float | None) -> set[str]:
@@ -183,7 +313,9 @@ class _Cleaner:
                     locked_files.add(urlpath)
                     locked_files.add(urlpath.rsplit(".lock", 1)[0])
 
-        return set(self.file_sizes) - locked_files - set(self.known_files)
+        # Use the primary database: replicas might miss new files
+        known_files = self.get_known_files(readonly=False)
+        return set(self.file_sizes) - locked_files - set(known_files)
 
     def delete_unknown_files(
         self, lock_validity_period: float | None, recursive: bool
@@ -256,17 +388,59 @@ class _Cleaner:
 
         filters = self._get_tag_filters(tags_to_clean, tags_to_keep)
         sorters = self._get_method_sorters(method)
+        stmt = (
+            sa.select(database.CacheEntry)
+            .filter(*filters)
+            .order_by(*[sorter.nulls_first() for sorter in sorters])
+            .execution_options(yield_per=batch_size or _YIELD_PER)
+        )
 
+        def sort_key(cache_entry: database.CacheEntry) -> tuple[Any, ...]:
+            # Same order as the database (NULLs first)
+            values = [getattr(cache_entry, sorter.key) for sorter in sorters]
+            return tuple((value is not None, value) for value in values)
+
+        def is_cleanable(cache_entry: database.CacheEntry) -> bool:
+            # Same as filters
+            if tags_to_keep is not None:
+                return cache_entry.tag not in tags_to_keep
+            if tags_to_clean is not None:
+                return cache_entry.tag in tags_to_clean
+            return True
+
+        store = config.get().metadata_store
+        sessionmakers = [] if store else config.get().instantiated_sessionmakers
         files_to_delete: set[str] = set()
         stop_cleaning = self.stop_cleaning(maxsize)
         while not stop_cleaning:
-            entries_to_delete: list[database.CacheEntry] = []
+            entries_to_delete: dict[int, list[database.CacheEntry]] = (
+                collections.defaultdict(list)
+            )
+            n_entries_to_delete = 0
             self.logger.info("getting cache entries to delete")
-            with config.get().instantiated_sessionmaker() as session:
-                for cache_entry in session.scalars(
-                    sa.select(database.CacheEntry).filter(*filters).order_by(*sorters)
+            with contextlib.ExitStack() as stack:
+                sessions = [stack.enter_context(sm()) for sm in sessionmakers]
+                for session in sessions:
+                    database._begin_immediate(session)
+                shard_entries: list[Iterable[database.CacheEntry]]
+                if store is None:
+                    # Streamed: iteration stops as soon as enough entries are found
+                    results = [session.scalars(stmt) for session in sessions]
+                    shard_entries = list(results)
+                else:
+                    results = []
+                    shard_entries = [
+                        sorted(filter(is_cleanable, store.iter_entries()), key=sort_key)
+                    ]
+                # Merge the sorted entries of all shards
+                for shard, cache_entry in heapq.merge(
+                    *[
+                        zip(itertools.repeat(shard), cache_entries)
+                        for shard, cache_entries in enumerate(shard_entries)
+                    ],
+                    key=lambda item: sort_key(item[1]),
                 ):
-                    if batch_size and len(entries_to_delete) >= batch_size:
+                    if batch_size and n_entries_to_delete >= batch_size:
                         break
 
                     files = _get_files_from_cache_entry(cache_entry, key="file:size")
@@ -274,19 +448,28 @@ class _Cleaner:
                         not self.stop_cleaning(maxsize)
                         and any(file.startswith(self.urldir) for file in files)
                     ) or (set(files) & files_to_delete):
-                        entries_to_delete.append(cache_entry)
+                        entries_to_delete[shard].append(cache_entry)
+                        n_entries_to_delete += 1
                         for file in files:
                             self.pop_file_size(file)
                             files_to_delete.add(file)
                 else:
                     stop_cleaning = True
+                for result in results:
+                    result.close()
 
-                if entries_to_delete:
+                if n_entries_to_delete:
                     self.logger.info(
                         "deleting cache entries",
-                        n_entries_to_delete=len(entries_to_delete),
+                        n_entries_to_delete=n_entries_to_delete,
                     )
-                _delete_cache_entries(session, *entries_to_delete)
+                if store is None:
+                    _fan_out(
+                        lambda item: _delete_cache_entries(sessions[item[0]], *item[1]),
+                        list(entries_to_delete.items()),
+                    )
+                else:
+                    _delete_store_entries(store, *entries_to_delete[0])
 
             if not stop_cleaning:
                 time.sleep(batch_delay)
@@ -385,29 +568,95 @@ def clean_invalid_cache_entries(
     batch_delay: float, default: 0
         Delay in seconds between processing batches.
     """
-    if check_expiration:
-        id_stmt = (
-            sa.select(database.CacheEntry.id)
-            .filter(database.CacheEntry.expiration <= utils.utcnow())
-            .execution_options(yield_per=batch_size)
-        )
-        with config.get().instantiated_sessionmaker() as session:
-            partitions = list(session.scalars(id_stmt).partitions())
-        for i, partition in enumerate(partitions):
-            entry_stmt = sa.select(database.CacheEntry).filter(
-                database.CacheEntry.id.in_(partition)
-            )
-            time.sleep(batch_delay if i else 0)
-            with config.get().instantiated_sessionmaker() as session:
-                _delete_cache_entries(session, *list(session.scalars(entry_stmt)))
+    now = utils.utcnow()
 
-    if try_decode:
-        with config.get().instantiated_sessionmaker() as session:
-            for cache_entry in session.scalars(sa.select(database.CacheEntry)):
+    store = config.get().metadata_store
+    if store is not None:
+        naive_now = now.replace(tzinfo=None)
+        for cache_entry in store.iter_entries():
+            expiration = cache_entry.expiration
+            if check_expiration and expiration is not None and expiration <= naive_now:
+                _delete_store_entries(store, cache_entry)
+            elif try_decode:
                 try:
                     decode.loads(cache_entry._result_as_string)
                 except decode.DecodeError:
-                    _delete_cache_entries(session, cache_entry)
+                    _delete_store_entries(store, cache_entry)
+        return
+
+    def clean_shard(sessionmaker: sa.orm.sessionmaker[sa.orm.Session]) -> None:
+        if check_expiration:
+            id_stmt = (
+                sa.select(database.CacheEntry.id)
+                .filter(database.CacheEntry.expiration <= now)
+                .execution_options(yield_per=batch_size)
+            )
+            with sessionmaker() as session:
+                partitions = list(session.scalars(id_stmt).partitions())
+            for i, partition in enumerate(partitions):
+                entry_stmt = sa.select(database.CacheEntry).filter(
+                    database.CacheEntry.id.in_(partition)
+                )
+                time.sleep(batch_delay if i else 0)
+                with sessionmaker() as session:
+                    database._begin_immediate(session)
+                    _delete_cache_entries(session, *list(session.scalars(entry_stmt)))
+
+        if try_decode:
+            with sessionmaker() as session:
+                database._begin_immediate(session)
+                for cache_entry in session.scalars(sa.select(database.CacheEntry)):
+                    try:
+                        decode.loads(cache_entry._result_as_string)
+                    except decode.DecodeError:
+                        _delete_cache_entries(session, cache_entry)
+
+    _fan_out(clean_shard, config.get().instantiated_sessionmakers)
+
+
+def _expire_store_entries(
+    store: stores.MetadataStore,
+    now: datetime.datetime,
+    tags: list[str] | None,
+    before: datetime.datetime | None,
+    after: datetime.date | None,
+    delete: bool,
+    dry_run: bool,
+) -> int:
+    def to_naive_utc(value: datetime.date) -> datetime.datetime:
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value, datetime.time())
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value
+
+    def is_selected(cache_entry: database.CacheEntry) -> bool:
+        # Same as filters
+        created_at = cache_entry.created_at
+        if tags is not None and cache_entry.tag not in tags:
+            return False
+        if before is not None and not (
+            created_at is not None and created_at < to_naive_utc(before)
+        ):
+            return False
+        if after is not None and not (
+            created_at is not None and created_at > to_naive_utc(after)
+        ):
+            return False
+        return True
+
+    cache_entries = list(filter(is_selected, store.iter_entries()))
+    if dry_run:
+        return len(cache_entries)
+    if delete:
+        _delete_store_entries(store, *cache_entries)
+    else:
+        config.get().logger.info(
+            "expiring cache entries", n_entries_to_expire=len(cache_entries)
+        )
+        store.expire_entries(now, *_get_entry_ids(*cache_entries))
+        _invalidate_local_entries(*cache_entries)
+    return len(cache_entries)
 
 
 def expire_cache_entries(
@@ -421,6 +670,10 @@ def expire_cache_entries(
 ) -> int:
     now = utils.utcnow()
 
+    store = config.get().metadata_store
+    if store is not None:
+        return _expire_store_entries(store, now, tags, before, after, delete, dry_run)
+
     filters: list[BinaryExpression[bool] | ColumnElement[bool]] = []
     if tags is not None:
         filters.append(database.CacheEntry.tag.in_(tags))
@@ -433,28 +686,40 @@ def expire_cache_entries(
         .filter(*filters)
         .execution_options(yield_per=batch_size)
     )
-    with config.get().instantiated_sessionmaker() as session:
-        partitions = list(session.scalars(id_stmt).partitions())
 
-    if dry_run:
-        return sum(len(partition) for partition in partitions)
+    def expire_shard(sessionmaker: sa.orm.sessionmaker[sa.orm.Session]) -> int:
+        with sessionmaker() as session:
+            partitions = list(session.scalars(id_stmt).partitions())
 
-    count = 0
-    for i, partition in enumerate(partitions):
-        entry_stmt = sa.select(database.CacheEntry).filter(
-            database.CacheEntry.id.in_(partition)
-        )
-        time.sleep(batch_delay if i else 0)
-        with config.get().instantiated_sessionmaker() as session:
-            cache_entries = list(session.scalars(entry_stmt))
-            count += len(cache_entries)
-            if delete:
-                _delete_cache_entries(session, *cache_entries)
-            else:
-                config.get().logger.info(
-                    "expiring cache entries", n_entries_to_expire=len(cache_entries)
-                )
-                for cache_entry in cache_entries:
-                    cache_entry.expiration = now
-                database._commit_or_rollback(session)
-    return count
+        if dry_run:
+            return sum(len(partition) for partition in partitions)
+
+        count = 0
+        for i, partition in enumerate(partitions):
+            entry_stmt = sa.select(database.CacheEntry).filter(
+                database.CacheEntry.id.in_(partition)
+            )
+            time.sleep(batch_delay if i else 0)
+            with sessionmaker() as session:
+                database._begin_immediate(session)
+                cache_entries = list(session.scalars(entry_stmt))
+                count += len(cache_entries)
+                if delete:
+                    _delete_cache_entries(session, *cache_entries)
+                else:
+                    config.get().logger.info(
+                        "expiring cache entries", n_entries_to_expire=len(cache_entries)
+                    )
+                    for cache_entry in cache_entries:
+                        cache_entry.expiration = now
+                    database._commit_or_rollback(session)
+                    _invalidate_local_entries(*cache_entries)
+        return count
+
+    settings = config.get()
+    sessionmakers = (
+        settings.instantiated_readonly_sessionmakers
+        if dry_run
+        else settings.instantiated_sessionmakers
+    )
+    return sum(_fan_out(expire_shard, sessionmakers))
@@ -18,16 +18,26 @@ from __future__ import annotations
 
 import binascii
 import collections.abc
+import contextlib
+import contextvars
+import dataclasses
 import datetime
+import functools
 import inspect
 import json
 import pickle
+import sys
 import warnings
-from typing import Any, Callable
+import weakref
+from typing import Any, Callable, Iterator
 
 from . import config, decode, utils
 
 _JSON_DUMPS_KWARGS: dict[str, Any] = {"separators": (",", ":"), "skipkeys": False}
+_HASH_MEMO: dict[int, tuple[weakref.ref[Any], dict[str, Any]]] = {}
+_HEXDIGEST: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "cacholote_hexdigest", default=None
+)
 
 
 def _hexdigestify_python_call(
@@ -36,9 +46,20 @@ def _hexdigestify_python_call(
     cache_kwargs: dict[str, Any] = {},
     **kwargs: Any,
 ) -> str:
-    return utils.hexdigestify(
-        dumps_python_call(func_to_hex, *args, cache_kwargs=cache_kwargs, **kwargs)
+    python_call = dictify_python_call(
+        func_to_hex, *args, cache_kwargs=cache_kwargs, **kwargs
     )
+    return utils.hexdigestify(dumps(python_call, default=hash_default))
+
+
+@contextlib.contextmanager
+def _set_hexdigest(hexdigest: str) -> Iterator[str]:
+    """Expose the key of the cache entry being encoded to the encoders."""
+    token = _HEXDIGEST.set(hexdigest)
+    try:
+        yield hexdigest
+    finally:
+        _HEXDIGEST.reset(token)
 
 
 def inspect_fully_qualified_name(obj: Callable[..., Any]) -> str:
@@ -133,6 +154,9 @@ FILECACHE_ENCODERS: list[tuple[Any, Callable[[Any], dict[str, Any]]]] = [
 ]
 
 
+HASH_ENCODERS: list[tuple[Any, Callable[[Any], dict[str, Any]]]] = []
+
+
 class EncodeError(Exception):
     pass
 
@@ -149,6 +173,8 @@ def filecache_default(
         Object to encode
     encoders: list, optional
         List of tuples of the form ``(type, encoder)``.
+        Types can also be fully qualified names (e.g., ``"xarray.Dataset"``),
+        so that the module is not imported until it is used.
         None: Use default ``cacholote.encode.FILECACHE_ENCODERS``
 
     Returns
@@ -158,6 +184,11 @@ def filecache_default(
     if encoders is None:
         encoders = FILECACHE_ENCODERS
     for type_, encoder in reversed(encoders):
+        if isinstance(type_, str):
+            module_name, _, type_name = type_.rpartition(".")
+            if (module := sys.modules.get(module_name)) is None:
+                continue
+            type_ = getattr(module, type_name)
         if isinstance(obj, type_):
             try:
                 return encoder(obj)
@@ -168,6 +199,78 @@ def filecache_default(
     raise EncodeError("can't encode object")
 
 
+def _is_immutable(obj: Any) -> bool:
+    if hasattr(obj, "__cacholote_token__"):
+        return True
+    if not (
+        dataclasses.is_dataclass(obj)
+        and not isinstance(obj, type)
+        and obj.__dataclass_params__.frozen  # type: ignore[attr-defined]
+    ):
+        return False
+    # Frozen dataclasses are only shallowly immutable (e.g., fields can be lists)
+    try:
+        hash(obj)
+    except TypeError:
+        return False
+    return True
+
+
+def _forget_hash(key: int, ref: weakref.ref[Any]) -> None:
+    if _HASH_MEMO.get(key, (None,))[0] is ref:
+        _HASH_MEMO.pop(key, None)
+
+
+def hash_default(obj: Any) -> dict[str, Any]:
+    """Dictify objects that are not JSON-serializable for hashing only.
+
+    Objects registered in ``cacholote.encode.HASH_ENCODERS`` are encoded with a
+    cheap fingerprint (e.g., they are NOT copied to the cache storage).
+    Objects implementing ``__cacholote_token__`` are encoded with the token returned.
+    All other objects are encoded as in ``filecache_default``.
+
+    Immutable objects (i.e., hashable frozen dataclasses and objects implementing
+    ``__cacholote_token__``) are encoded with the digest of their encoding,
+    which is remembered as long as the object is alive.
+
+    Parameters
+    ----------
+    obj: Any
+        Object to encode
+
+    Returns
+    -------
+    dict
+    """
+    key = id(obj)
+    if (memo := _HASH_MEMO.get(key)) is not None and memo[0]() is obj:
+        return memo[1]
+
+    if hasattr(obj, "__cacholote_token__"):
+        encoded = {
+            "type": "python_token",
+            "class": inspect_fully_qualified_name(type(obj)),
+            "token": obj.__cacholote_token__(),
+        }
+    else:
+        encoded = filecache_default(obj, encoders=FILECACHE_ENCODERS + HASH_ENCODERS)
+
+    if not _is_immutable(obj):
+        return encoded
+
+    encoded = {
+        "type": "python_digest",
+        "digest": utils.hexdigestify(dumps(encoded, default=hash_default)),
+    }
+    try:
+        ref = weakref.ref(obj, functools.partial(_forget_hash, key))
+    except TypeError:
+        # Not weak referenceable (e.g., __slots__)
+        return encoded
+    _HASH_MEMO[key] = (ref, encoded)
+    return encoded
+
+
 def dumps(
     obj: Any,
     **kwargs: Any,
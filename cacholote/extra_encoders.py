@@ -16,18 +16,32 @@
 # limitations under the License.
 from __future__ import annotations
 
+import bz2
+import collections
+import concurrent.futures
 import contextlib
+import fnmatch
 import functools
+import gzip
 import hashlib
+import importlib.util
 import inspect
 import io
+import json
+import lzma
 import mimetypes
+import mmap
+import os
 import pathlib
 import posixpath
 import tempfile
+import threading
 import time
+import uuid
+import warnings
 from collections.abc import Generator
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     Literal,
@@ -39,27 +53,36 @@ from typing import (
 
 import fsspec
 import fsspec.implementations.local
+import fsspec.utils
 import pydantic
 
 from . import config, encode, utils
 
-try:
-    import dask
+if TYPE_CHECKING:
     import xarray as xr
 
-    _HAS_XARRAY_AND_DASK = True
-except ImportError:
-    _HAS_XARRAY_AND_DASK = False
-
-try:
-    import magic
-
-    _HAS_MAGIC = True
-except ImportError:
-    _HAS_MAGIC = False
+# Heavy optional dependencies are imported when first used
+_HAS_XARRAY_AND_DASK = all(
+    importlib.util.find_spec(name) is not None for name in ("xarray", "dask")
+)
+_HAS_MAGIC = importlib.util.find_spec("magic") is not None
+_HAS_KERCHUNK = importlib.util.find_spec("kerchunk") is not None
 
 F = TypeVar("F", bound=Callable[..., Any])
 
+_XR_FINGERPRINT_SAMPLE_SIZE = 1_024
+# File types are sniffed from the first bytes only
+_MAGIC_PREFIX_SIZE = 2_048
+_TRANSFER_EVENTS = ("upload", "download")
+_COMPRESSION_EXTENSIONS = {"bz2": ".bz2", "gzip": ".gz", "xz": ".xz", "zstd": ".zst"}
+# Files written sequentially can be streamed through pipes (NetCDF writers seek)
+_STREAMABLE_XR_TYPES = ("application/x-grib",)
+_CAN_STREAM = os.path.isdir("/dev/fd")
+_HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+_REFERENCES_SUFFIX = ".refs.json"
+# Temporary local copies left by crashed downloads are removed after this time
+_LOCAL_COPY_TMP_MAX_AGE = 24 * 60 * 60
+
 _UNION_IO_TYPES = Union[
     io.RawIOBase,
     io.BufferedIOBase,
@@ -91,10 +114,20 @@ def _guess_type(
     filetype, *_ = mimetypes.guess_type(local_path, strict=False)
     if filetype is None and _HAS_MAGIC:
         with fs.open(local_path, "rb") as f:
-            filetype = magic.from_buffer(f.read(), mime=True)
+            filetype = _sniff_type(f.read(_MAGIC_PREFIX_SIZE))
     return filetype or default
 
 
+def _sniff_type(prefix: bytes) -> str | None:
+    if not _HAS_MAGIC:
+        return None
+    try:
+        import magic
+    except ImportError:  # e.g., libmagic is not installed
+        return None
+    return str(magic.from_buffer(prefix, mime=True))
+
+
 def _requires_xarray_and_dask(func: F) -> F:
     """Raise an error if `xarray` or `dask` are not installed."""
 
@@ -124,6 +157,9 @@ def _logging_timer(event: str, **kwargs: Any) -> Generator[float, None, None]:
     toc = time.perf_counter()
 
     kwargs["_".join(event.split() + ["time"])] = toc - tic  # elapsed time
+    if event in _TRANSFER_EVENTS and kwargs.get("size") and toc > tic:
+        # bytes per second
+        kwargs["_".join(event.split() + ["throughput"])] = kwargs["size"] / (toc - tic)
     logger.info(f"end {event}", **kwargs)
     if event == "upload" and context is not None:
         context.upload_log(f"end {event}. {_kwargs_to_str(**kwargs)}")
@@ -133,6 +169,87 @@ class InPlaceFile(io.FileIO):
     pass
 
 
+class MappedFile(io.BufferedIOBase):
+    """Read-only file object backed by a memory map of a local file.
+
+    ``getbuffer`` returns a zero-copy view of the content, e.g., to create arrays
+    with ``numpy.frombuffer(f.getbuffer(), dtype=...)``.
+    """
+
+    mode = "rb"
+
+    def __init__(self, path: str) -> None:
+        self.name = path
+        with open(path, "rb") as f:
+            # Empty files can NOT be mapped
+            self._buffer: mmap.mmap | bytes = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if os.fstat(f.fileno()).st_size
+                else b""
+            )
+        self._position = 0
+
+    def getbuffer(self) -> memoryview:
+        self._check_not_closed()
+        return memoryview(self._buffer)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        self._check_not_closed()
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._check_not_closed()
+        start = {
+            io.SEEK_SET: 0,
+            io.SEEK_CUR: self._position,
+            io.SEEK_END: len(self._buffer),
+        }
+        self._position = max(0, start[whence] + offset)
+        return self._position
+
+    def read(self, size: int | None = -1) -> bytes:
+        self._check_not_closed()
+        end = len(self._buffer)
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+        data = self._buffer[self._position : end]
+        self._position = max(self._position, end)
+        return bytes(data)
+
+    read1 = read
+
+    def readinto(self, buffer: Any) -> int:
+        data = self.read(len(memoryview(buffer).cast("B")))
+        memoryview(buffer).cast("B")[: len(data)] = data
+        return len(data)
+
+    def readline(self, size: int | None = -1) -> bytes:
+        self._check_not_closed()
+        end = self._buffer.find(b"\n", self._position) + 1 or len(self._buffer)
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+        return self.read(max(0, end - self._position))
+
+    def close(self) -> None:
+        if not self.closed and isinstance(self._buffer, mmap.mmap):
+            try:
+                self._buffer.close()
+            except BufferError:
+                # Exported views keep the memory map alive
+                pass
+        super().close()
+
+    def _check_not_closed(self) -> None:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+
+
 class FileInfoModel(pydantic.BaseModel):
     type: str
     href: str
@@ -141,22 +258,44 @@ class FileInfoModel(pydantic.BaseModel):
     file_local_path: str = pydantic.Field(..., alias="file:local_path")
 
 
-def _dictify_file(fs: fsspec.AbstractFileSystem, local_path: str) -> dict[str, Any]:
+def _get_checksum(fs: fsspec.AbstractFileSystem, urlpath: str) -> str:
+    if "file" in fs.protocol:
+        # Adding or removing hard links changes the number of links and ctime
+        info = {
+            k: v for k, v in fs.info(urlpath).items() if k not in ("nlink", "created")
+        }
+        return f"{int(fsspec.utils.tokenize(info), 16):x}"
+    return f"{fs.checksum(urlpath):x}"
+
+
+def _dictify_file(
+    fs: fsspec.AbstractFileSystem, local_path: str, filetype: str | None = None
+) -> dict[str, Any]:
     settings = config.get()
     href = posixpath.join(
         settings.cache_files_urlpath_readonly or settings.cache_files_urlpath,
         posixpath.basename(local_path),
     )
     file_dict = {
-        "type": _guess_type(fs, local_path),
+        "type": filetype or _guess_type(fs, local_path),
         "href": href,
-        "file:checksum": f"{fs.checksum(local_path):x}",
+        "file:checksum": _get_checksum(fs, local_path),
         "file:size": fs.size(local_path),
         "file:local_path": local_path,
     }
     return FileInfoModel(**file_dict).model_dump(by_alias=True)
 
 
+def _get_lock_timeout(settings: config.Settings) -> float | None:
+    # Waiting on locks is part of the latency budget
+    timeouts = [
+        timeout
+        for timeout in (settings.lock_timeout, settings.lookup_timeout)
+        if timeout is not None
+    ]
+    return min(timeouts) if timeouts else None
+
+
 def _get_fs_and_urlpath(
     file_json: dict[str, Any],
     storage_options: dict[str, Any] | None = None,
@@ -182,9 +321,10 @@ def _get_fs_and_urlpath(
             actual = (
                 fs.checksum(urlpath)  # Just for backward compatibility.
                 if isinstance(expected, int)
-                else f"{fs.checksum(urlpath):x}"
+                else _get_checksum(fs, urlpath)
             )
-            if expected != actual:
+            # Local checksums used to include the number of hard links and ctime
+            if expected != actual and expected != f"{fs.checksum(urlpath):x}":
                 raise ValueError(f"checksum mismatch: {urlpath=} {expected=} {actual=}")
             settings.logger.info(
                 "retrieve cache file", urlpath=fs.unstrip_protocol(urlpath)
@@ -203,6 +343,144 @@ def _get_fs_and_urlpath(
     )
 
 
+def _copy_file_parts(
+    fs_in: fsspec.AbstractFileSystem,
+    urlpath_in: str,
+    f_out: Any,
+    size: int | None,
+) -> None:
+    """Copy a file to ``f_out``, downloading parts concurrently with range requests.
+
+    Parts are written (i.e., uploaded) sequentially, in order.
+    """
+    settings = config.get()
+    part_size = settings.transfer_part_size
+    if size is None or size <= part_size:
+        with fs_in.open(urlpath_in, "rb") as f_in:
+            utils.copy_buffered_file(f_in, f_out, buffer_size=part_size)
+        return
+
+    def get_part(start: int) -> bytes:
+        end = min(start + part_size, size)
+        data: bytes = fs_in.cat_file(urlpath_in, start=start, end=end)
+        if len(data) != end - start:
+            raise OSError(f"range requests are NOT supported: {urlpath_in!r}")
+        return data
+
+    # Parts are fetched concurrently with range requests, and written in order
+    with concurrent.futures.ThreadPoolExecutor(
+        settings.transfer_concurrency
+    ) as executor:
+        futures: collections.deque[concurrent.futures.Future[bytes]] = (
+            collections.deque()
+        )
+        for start in range(0, size, part_size):
+            futures.append(executor.submit(get_part, start))
+            if len(futures) >= settings.transfer_concurrency:
+                f_out.write(futures.popleft().result())
+        while futures:
+            f_out.write(futures.popleft().result())
+
+
+def _get_compression(filetype: str) -> str | None:
+    for pattern, compression in config.get().cache_files_compression.items():
+        if fnmatch.fnmatchcase(filetype, pattern):
+            return compression
+    return None
+
+
+def _open_compressor(f: Any, compression: str, level: int | None) -> Any:
+    if compression == "zstd":
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return compressor.stream_writer(f, closefd=False)
+
+    kwargs: dict[str, Any] = {}
+    if level is not None:
+        kwargs["preset" if compression == "xz" else "compresslevel"] = level
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="wb", **kwargs)
+    if compression == "bz2":
+        return bz2.BZ2File(f, mode="wb", **kwargs)
+    if compression == "xz":
+        return lzma.LZMAFile(f, mode="wb", **kwargs)
+    raise ValueError(f"{compression=} is NOT supported.")
+
+
+def _evict_local_copies(dirname: str, maxsize: int, keep: str) -> None:
+    # Least recently used copies first (hits update mtime)
+    with utils._flock(os.path.join(dirname, ".evict.lock"), blocking=False) as acquired:
+        if not acquired:
+            return
+        now = time.time()
+        copies = []
+        for entry in os.scandir(dirname):
+            if entry.name.startswith(".") or entry.name.endswith(".lock"):
+                continue
+            stat = entry.stat()
+            if entry.name.endswith(".tmp"):
+                if now - stat.st_mtime > _LOCAL_COPY_TMP_MAX_AGE:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(entry.path)
+                continue
+            copies.append((stat.st_mtime, stat.st_size, entry.path))
+
+        disk_usage = sum(size for _, size, _ in copies)
+        for _, size, path in sorted(copies):
+            if disk_usage <= maxsize:
+                break
+            if path != keep:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                disk_usage -= size
+
+
+def _get_local_copy(
+    fs: fsspec.AbstractFileSystem, urlpath: str, file_json: dict[str, Any]
+) -> str | None:
+    """Return the path of a node-local copy of a remote cache file.
+
+    Copies are named after the checksum of the remote file, and downloaded once
+    by concurrent processes. Return None if local copies are disabled.
+    """
+    settings = config.get()
+    dirname = settings.cache_files_local_dir
+    size: int = file_json["file:size"]
+    if dirname is None or "file" in fs.protocol:
+        return None
+    if size > settings.cache_files_local_maxsize:
+        return None
+
+    os.makedirs(dirname, exist_ok=True)
+    local_path = os.path.join(
+        dirname, f"{file_json['file:checksum']}{pathlib.PurePosixPath(urlpath).suffix}"
+    )
+
+    def is_valid() -> bool:
+        try:
+            return os.path.getsize(local_path) == size
+        except FileNotFoundError:
+            return False
+
+    if is_valid():
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(local_path)
+            return local_path
+
+    with utils._flock(f"{local_path}.lock"):
+        if not is_valid():
+            tmp_path = f"{local_path}.{uuid.uuid4().hex}.tmp"
+            with _logging_timer(
+                "download", urlpath=fs.unstrip_protocol(urlpath), size=size
+            ):
+                with open(tmp_path, "wb") as f_out:
+                    _copy_file_parts(fs, urlpath, f_out, size)
+            os.replace(tmp_path, local_path)
+    _evict_local_copies(dirname, settings.cache_files_local_maxsize, keep=local_path)
+    return local_path
+
+
 @overload
 def decode_xr_object(
     file_json: dict[str, Any],
@@ -234,9 +512,22 @@ def decode_xr_object(
 
     if file_json["type"] == "application/vnd+zarr":
         filename_or_obj = fs.get_mapper(urlpath)
+    elif (
+        "file" not in fs.protocol
+        and "file:references" in file_json
+        and urlpath == file_json["file:local_path"]
+    ):
+        # Lazy access with range requests
+        filename_or_obj = _get_references_mapper(
+            fs, file_json["file:references"], storage_options
+        )
+        kwargs.update({"engine": "zarr", "consolidated": False})
+        kwargs.setdefault("chunks", {})
     else:
         if "file" in fs.protocol:
             filename_or_obj = urlpath
+        elif local_path := _get_local_copy(fs, urlpath, file_json):
+            filename_or_obj = local_path
         else:
             # Download local copy
             protocols = (fs.protocol,) if isinstance(fs.protocol, str) else fs.protocol
@@ -247,6 +538,8 @@ def decode_xr_object(
             ) as of:
                 filename_or_obj = of.name
 
+    import xarray as xr
+
     kwargs.setdefault("decode_timedelta", False)
     if xr_type == "Dataset":
         return xr.open_dataset(filename_or_obj, **kwargs)
@@ -271,7 +564,112 @@ def decode_io_object(
     fs, urlpath = _get_fs_and_urlpath(
         file_json, storage_options=storage_options, validate=True
     )
-    return fs.open(urlpath, **kwargs)
+    compression = file_json.get("file:compression")
+    local_path = urlpath if "file" in fs.protocol else None
+    if local_path := local_path or _get_local_copy(fs, urlpath, file_json):
+        if (
+            config.get().io_mmap
+            and compression is None
+            and kwargs.get("mode", "rb") == "rb"
+        ):
+            return MappedFile(fs._strip_protocol(local_path))
+        return fsspec.filesystem("file").open(
+            local_path, compression=compression, **kwargs
+        )
+    return fs.open(urlpath, compression=compression, **kwargs)
+
+
+def _get_references_mapper(
+    fs: fsspec.AbstractFileSystem,
+    references_json: dict[str, Any],
+    storage_options: dict[str, Any],
+) -> fsspec.FSMap:
+    protocol = fs.protocol if isinstance(fs.protocol, str) else fs.protocol[0]
+    refs_fs, *_ = fsspec.get_fs_token_paths(
+        references_json["file:local_path"], storage_options=storage_options
+    )
+    ref_fs = fsspec.filesystem(
+        "reference",
+        fo=refs_fs.unstrip_protocol(references_json["file:local_path"]),
+        target_protocol=protocol,
+        target_options=storage_options,
+        remote_protocol=protocol,
+        remote_options=fs.storage_options,
+    )
+    return ref_fs.get_mapper("")
+
+
+def _store_references(
+    local_path: str, fs: fsspec.AbstractFileSystem, urlpath: str
+) -> None:
+    with open(local_path, "rb") as f:
+        if f.read(len(_HDF5_SIGNATURE)) != _HDF5_SIGNATURE:
+            # Only NetCDF4/HDF5 files are indexed
+            return
+        f.seek(0)
+
+        from kerchunk.hdf import SingleHdf5ToZarr
+
+        with _logging_timer("write references", urlpath=fs.unstrip_protocol(urlpath)):
+            references = SingleHdf5ToZarr(
+                f, url=fs.unstrip_protocol(urlpath)
+            ).translate()
+    fs.pipe_file(urlpath + _REFERENCES_SUFFIX, json.dumps(references).encode())
+
+
+def _dictify_references(
+    fs: fsspec.AbstractFileSystem, urlpath: str
+) -> dict[str, Any] | None:
+    refs_urlpath = urlpath + _REFERENCES_SUFFIX
+    if not fs.exists(refs_urlpath):
+        return None
+    return {
+        "type": "application/json",
+        "file:size": fs.size(refs_urlpath),
+        "file:local_path": refs_urlpath,
+    }
+
+
+def _stream_file_object(
+    write: Callable[[str], Any], fs: fsspec.AbstractFileSystem, urlpath: str
+) -> None:
+    """Upload a file while it is written, without a local copy.
+
+    ``write`` is called in a thread with the path of a pipe, and completed parts are
+    uploaded while the rest of the file is still being written.
+    """
+    f_out = fs.open(urlpath, "wb")
+    read_fd, write_fd = os.pipe()
+    errors: list[BaseException] = []
+
+    def target() -> None:
+        try:
+            write(f"/dev/fd/{write_fd}")
+        except BaseException as ex:
+            errors.append(ex)
+        finally:
+            # Signal the end of the file
+            os.close(write_fd)
+
+    thread = threading.Thread(target=target, name="cacholote-writer", daemon=True)
+    thread.start()
+    try:
+        try:
+            # Closing the pipe on errors stops the writer
+            with os.fdopen(read_fd, "rb") as f_in:
+                utils.copy_buffered_file(
+                    f_in, f_out, buffer_size=getattr(f_out, "blocksize", None)
+                )
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
+    except BaseException:
+        f_out.close()
+        if fs.exists(urlpath):
+            fs.rm(urlpath)
+        raise
+    f_out.close()
 
 
 @_requires_xarray_and_dask
@@ -288,6 +686,15 @@ def _store_xr_object(
             obj.to_zarr(mapper, consolidated=True)
         return
 
+    if filetype in _STREAMABLE_XR_TYPES and _CAN_STREAM and "file" not in fs.protocol:
+        import cfgrib.xarray_to_grib
+
+        with _logging_timer("upload", urlpath=fs.unstrip_protocol(urlpath)):
+            _stream_file_object(
+                functools.partial(cfgrib.xarray_to_grib.to_grib, obj), fs, urlpath
+            )
+        return
+
     # Need a tmp local copy to write on a different filesystem
     with tempfile.TemporaryDirectory() as tmpdirname:
         tmpfilename = str(pathlib.Path(tmpdirname) / pathlib.Path(urlpath).name)
@@ -303,6 +710,21 @@ def _store_xr_object(
                 # Should never get here! xarray_cache_type is checked in config.py
                 raise ValueError(f"type {filetype!r} is NOT supported.")
 
+        if (
+            config.get().xarray_reference_index
+            and filetype == "application/netcdf"
+            and "file" not in fs.protocol
+        ):
+            if _HAS_KERCHUNK:
+                # References point to the final location of the cache file
+                _store_references(tmpfilename, fs, urlpath)
+            else:
+                warnings.warn(
+                    "`xarray_reference_index` requires kerchunk: NetCDF files are"
+                    " NOT indexed.",
+                    UserWarning,
+                )
+
         _store_file_object(
             fs if "file" in fs.protocol else fsspec.filesystem("file"),
             tmpfilename,
@@ -312,12 +734,109 @@ def _store_xr_object(
         )
 
 
+def _sample_xr_variable(variable: xr.Variable) -> Any:
+    import dask.base
+
+    if dask.base.is_dask_collection(variable.data):
+        # Tokenizing dask arrays does not compute them
+        return variable.data
+    values = variable.values.ravel()
+    step = max(1, values.size // _XR_FINGERPRINT_SAMPLE_SIZE)
+    return values[::step]
+
+
+def _get_xr_lazy_selection(variable: xr.Variable) -> Any:
+    """Return what selects the values of a variable from its source.
+
+    Return None if values are in memory (i.e., they might have been modified).
+    """
+    import dask.base
+    import numpy as np
+    from xarray.core import indexing
+
+    data: Any = variable._data
+    if dask.base.is_dask_collection(data):
+        # Tokenized by name (graph of the selection)
+        return data
+    if isinstance(data, indexing.PandasIndexingAdapter):
+        return data.array
+    selection = []
+    while not isinstance(data, (np.ndarray, indexing.NumpyIndexingAdapter)):
+        key = getattr(data, "key", None)
+        selection.append((type(data).__name__, None if key is None else key.tuple))
+        if not hasattr(data, "array"):
+            # Backend array
+            return selection
+        data = data.array
+    return None
+
+
+def _get_xr_source_checksum(obj: xr.Dataset | xr.DataArray) -> str | None:
+    if (source := obj.encoding.get("source")) is None:
+        return None
+    fs, _, (path,) = fsspec.get_fs_token_paths(source)
+    return f"{fs.checksum(path):x}" if fs.exists(path) else None
+
+
+@_requires_xarray_and_dask
+def _tokenize_xr_object(
+    obj: xr.Dataset | xr.DataArray,
+    fingerprint: Literal["content", "sampled", "metadata", "key"],
+) -> str:
+    if fingerprint == "key":
+        if (hexdigest := encode._HEXDIGEST.get()) is not None:
+            # Unique name for each cache entry: no data is hashed
+            return f"{hexdigest}-{uuid.uuid4().hex[:8]}"
+        fingerprint = "content"
+
+    import dask.base
+    import dask.config
+    import xarray as xr
+
+    with dask.config.set({"tokenize.ensure-deterministic": True}):
+        if fingerprint == "content":
+            return str(dask.base.tokenize(obj))
+
+        metadata = obj.to_dict(data=False)
+        if fingerprint == "metadata":
+            variables = obj.variables if isinstance(obj, xr.Dataset) else obj.coords
+            selections = [
+                (name, _get_xr_lazy_selection(var)) for name, var in variables.items()
+            ]
+            if isinstance(obj, xr.DataArray):
+                selections.append((obj.name, _get_xr_lazy_selection(obj.variable)))
+            checksum = _get_xr_source_checksum(obj)
+            if checksum is None or any(sel is None for _, sel in selections):
+                # Metadata does NOT identify in-memory (i.e., modified) values
+                return str(dask.base.tokenize(obj))
+            return str(
+                dask.base.tokenize(
+                    metadata, obj.encoding["source"], checksum, selections
+                )
+            )
+
+        if fingerprint == "sampled":
+            variables = obj.variables if isinstance(obj, xr.Dataset) else obj.coords
+            samples = {
+                name: _sample_xr_variable(var) for name, var in variables.items()
+            }
+            data_sample = (
+                _sample_xr_variable(obj.variable)
+                if isinstance(obj, xr.DataArray)
+                else None
+            )
+            return str(dask.base.tokenize(metadata, samples, data_sample))
+
+    raise ValueError(f"{fingerprint=} is NOT supported.")
+
+
 @_requires_xarray_and_dask
 def dictify_xr_object(obj: xr.Dataset | xr.DataArray) -> dict[str, Any]:
     """Encode a ``xr.Dataset`` to JSON deserialized data (``dict``)."""
+    import xarray as xr
+
     settings = config.get()
-    with dask.config.set({"tokenize.ensure-deterministic": True}):
-        root = dask.base.tokenize(obj)
+    root = _tokenize_xr_object(obj, settings.xarray_fingerprint)
 
     ext = mimetypes.guess_extension(settings.xarray_cache_type, strict=False)
     urlpath_out = posixpath.join(settings.cache_files_urlpath, f"{root}{ext}")
@@ -327,12 +846,18 @@ def dictify_xr_object(obj: xr.Dataset | xr.DataArray) -> dict[str, Any]:
         storage_options=settings.cache_files_storage_options,
     )
     with utils.FileLock(
-        fs_out, urlpath_out, timeout=settings.lock_timeout
+        fs_out, urlpath_out, timeout=_get_lock_timeout(settings)
     ) as file_exists:
         if not file_exists:
             _store_xr_object(obj, fs_out, urlpath_out, settings.xarray_cache_type)
 
         file_json = _dictify_file(fs_out, urlpath_out)
+        if (
+            settings.xarray_reference_index
+            and settings.xarray_cache_type == "application/netcdf"
+            and (references_json := _dictify_references(fs_out, urlpath_out))
+        ):
+            file_json["file:references"] = references_json
 
         kwargs: dict[str, Any] = {"chunks": {}}
         if settings.xarray_cache_type == "application/vnd+zarr":
@@ -346,33 +871,66 @@ def dictify_xr_object(obj: xr.Dataset | xr.DataArray) -> dict[str, Any]:
         )
 
 
+@_requires_xarray_and_dask
+def fingerprint_xr_object(obj: xr.Dataset | xr.DataArray) -> dict[str, Any]:
+    """Fingerprint a ``xr.Dataset`` for hashing (the object is NOT stored)."""
+    return {"type": "xr_fingerprint", "token": _tokenize_xr_object(obj, "content")}
+
+
 def _store_file_object(
     fs_in: fsspec.AbstractFileSystem,
     urlpath_in: str,
     fs_out: fsspec.AbstractFileSystem,
     urlpath_out: str,
     io_delete_original: bool | None = None,
+    content_type: str | None = None,
+    compression: str | None = None,
 ) -> None:
     if io_delete_original is None:
         io_delete_original = config.get().io_delete_original
 
     kwargs = {}
-    if content_type := _guess_type(fs_in, urlpath_in):
+    if content_type := content_type or _guess_type(fs_in, urlpath_in):
         kwargs["ContentType"] = content_type
+    size = fs_in.size(urlpath_in)
     with _logging_timer(
-        "upload",
-        urlpath=fs_out.unstrip_protocol(urlpath_out),
-        size=fs_in.size(urlpath_in),
+        "upload", urlpath=fs_out.unstrip_protocol(urlpath_out), size=size
     ):
-        if fs_in == fs_out or ("file" in fs_in.protocol and "file" in fs_out.protocol):
+        if compression is not None:
+            level = config.get().cache_files_compression_level
+            with fs_in.open(urlpath_in, "rb") as f_in:
+                with fs_out.open(urlpath_out, "wb") as f_out:
+                    with _open_compressor(f_out, compression, level) as f_compressed:
+                        utils.copy_buffered_file(
+                            f_in,
+                            f_compressed,
+                            buffer_size=config.get().transfer_part_size,
+                        )
+        elif "file" in fs_in.protocol and "file" in fs_out.protocol:
+            if io_delete_original:
+                fs_in.mv(urlpath_in, urlpath_out, **kwargs)
+            else:
+                local_path = fs_out._strip_protocol(urlpath_out)
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                utils._clone_file(
+                    fs_in._strip_protocol(urlpath_in),
+                    local_path,
+                    config.get().io_copy_strategy,
+                )
+        elif type(fs_in) is type(fs_out) and (
+            fs_in.storage_options == fs_out.storage_options
+        ):
+            # Server-side copy (instances are NOT shared across threads or when the
+            # instance cache is skipped)
             func = fs_in.mv if io_delete_original else fs_in.cp
             func(urlpath_in, urlpath_out, **kwargs)
         elif "file" in fs_in.protocol:
             fs_out.put(urlpath_in, urlpath_out, **kwargs)
         else:
-            with fs_in.open(urlpath_in, "rb") as f_in:
-                with fs_out.open(urlpath_out, "wb") as f_out:
-                    utils.copy_buffered_file(f_in, f_out)
+            with fs_out.open(
+                urlpath_out, "wb", block_size=config.get().transfer_part_size
+            ) as f_out:
+                _copy_file_parts(fs_in, urlpath_in, f_out, size)
 
     if io_delete_original and fs_in.exists(urlpath_in):
         with _logging_timer(
@@ -383,14 +941,82 @@ def _store_file_object(
             fs_in.rm(urlpath_in)
 
 
-def _store_io_object(
-    f_in: _UNION_IO_TYPES,
+def _store_content_addressed_file(
+    fs_in: fsspec.AbstractFileSystem,
+    urlpath_in: str,
     fs_out: fsspec.AbstractFileSystem,
     urlpath_out: str,
-) -> None:
-    f_out = fs_out.open(urlpath_out, "wb")
-    with _logging_timer("upload", urlpath=fs_out.unstrip_protocol(urlpath_out)):
-        utils.copy_buffered_file(f_in, f_out)
+    io_delete_original: bool | None = None,
+    compression: str | None = None,
+) -> str:
+    """Copy a file, computing the digest of its content in the same pass.
+
+    Return the MD5 hex digest of the (uncompressed) content.
+    """
+    settings = config.get()
+    if io_delete_original is None:
+        io_delete_original = settings.io_delete_original
+
+    md5 = hashlib.md5()
+    size = fs_in.size(urlpath_in)
+    with _logging_timer(
+        "upload", urlpath=fs_out.unstrip_protocol(urlpath_out), size=size
+    ):
+        if (
+            io_delete_original
+            and compression is None
+            and "file" in fs_in.protocol
+            and "file" in fs_out.protocol
+        ):
+            # Renamed: the file is only read to compute the digest
+            fs_in.mv(urlpath_in, urlpath_out)
+            with fs_out.open(urlpath_out, "rb") as f_in:
+                while data := f_in.read(settings.transfer_part_size):
+                    md5.update(data)
+            return md5.hexdigest()
+
+        with fs_in.open(urlpath_in, "rb") as f_in:
+            with fs_out.open(urlpath_out, "wb") as f_out:
+                with (
+                    contextlib.nullcontext(f_out)
+                    if compression is None
+                    else _open_compressor(
+                        f_out, compression, settings.cache_files_compression_level
+                    )
+                ) as f:
+                    while data := f_in.read(settings.transfer_part_size):
+                        md5.update(data)
+                        f.write(data)
+
+    if io_delete_original and fs_in.exists(urlpath_in):
+        with _logging_timer(
+            "remove", urlpath=fs_in.unstrip_protocol(urlpath_in), size=size
+        ):
+            fs_in.rm(urlpath_in)
+    return md5.hexdigest()
+
+
+def _spool_io_object(f_in: _UNION_IO_TYPES, local_path: str) -> tuple[str, str]:
+    """Copy a stream to a local file.
+
+    The digest of the content and the file type are computed in the same pass.
+    Return the MD5 hex digest and the file type.
+    """
+    md5 = hashlib.md5()  # fsspec uses md5
+    prefix = b""
+    with open(local_path, "wb") as f_out:
+        while data := f_in.read(io.DEFAULT_BUFFER_SIZE):
+            data = data if isinstance(data, bytes) else data.encode()
+            md5.update(data)
+            f_out.write(data)
+            if len(prefix) < _MAGIC_PREFIX_SIZE:
+                prefix += data[: _MAGIC_PREFIX_SIZE - len(prefix)]
+    return md5.hexdigest(), _sniff_type(prefix) or "application/octet-stream"
+
+
+def _get_open_kwargs(obj: _UNION_IO_TYPES) -> dict[str, Any]:
+    params = inspect.signature(open).parameters
+    return {k: getattr(obj, k) for k in params.keys() if hasattr(obj, k)}
 
 
 def dictify_io_object(obj: _UNION_IO_TYPES) -> dict[str, Any]:
@@ -400,46 +1026,120 @@ def dictify_io_object(obj: _UNION_IO_TYPES) -> dict[str, Any]:
 
     cache_files_urlpath = settings.cache_files_urlpath
 
-    if urlpath_in := getattr(obj, "path", getattr(obj, "name", "")):
-        fs_in = getattr(obj, "fs", fsspec.filesystem("file"))
-        if is_in_place:
-            urlpath_out = urlpath_in
-        else:
-            root = f"{fs_in.checksum(urlpath_in):x}"
+    with contextlib.ExitStack() as stack:
+        io_delete_original = content_type = urlpath_tmp = None
+        if urlpath_in := getattr(obj, "path", getattr(obj, "name", "")):
+            fs_in = getattr(obj, "fs", fsspec.filesystem("file"))
             ext = pathlib.Path(urlpath_in).suffix
-            urlpath_out = posixpath.join(cache_files_urlpath, f"{root}{ext}")
-    else:
-        root = hashlib.md5(f"{hash(obj)}".encode()).hexdigest()  # fsspec uses md5
-        urlpath_out = posixpath.join(cache_files_urlpath, root)
+            if is_in_place:
+                urlpath_out = urlpath_in
+            elif settings.io_content_addressed and "file" in fs_in.protocol:
+                # Copied to a temporary file, then renamed after its content
+                urlpath_out = urlpath_tmp = posixpath.join(
+                    cache_files_urlpath, f"{uuid.uuid4().hex}.tmp"
+                )
+            else:
+                root = f"{fs_in.checksum(urlpath_in):x}"
+                urlpath_out = posixpath.join(cache_files_urlpath, f"{root}{ext}")
+        else:
+            # Nameless streams are read once, and named after their content
+            tmpdirname = stack.enter_context(tempfile.TemporaryDirectory())
+            fs_in = fsspec.filesystem("file")
+            urlpath_in = str(pathlib.Path(tmpdirname) / "spool")
+            root, content_type = _spool_io_object(obj, urlpath_in)
+            io_delete_original = True
+            ext = ""
+            urlpath_out = posixpath.join(cache_files_urlpath, root)
+
+        filetype = compression = None
+        if settings.cache_files_compression and not is_in_place:
+            filetype = content_type or _guess_type(fs_in, urlpath_in)
+            if compression := _get_compression(filetype):
+                ext += _COMPRESSION_EXTENSIONS[compression]
+                urlpath_out += _COMPRESSION_EXTENSIONS[compression]
 
-    if is_in_place:
-        fs_out = fs_in
-    else:
-        fs_out, *_ = fsspec.get_fs_token_paths(
-            cache_files_urlpath,
-            storage_options=settings.cache_files_storage_options,
-        )
+        if is_in_place:
+            fs_out = fs_in
+        else:
+            fs_out, *_ = fsspec.get_fs_token_paths(
+                cache_files_urlpath,
+                storage_options=settings.cache_files_storage_options,
+            )
 
-    with utils.FileLock(
-        fs_out, urlpath_out, timeout=settings.lock_timeout
-    ) as file_exists:
-        if not (file_exists or is_in_place):
-            if urlpath_in:
-                _store_file_object(fs_in, urlpath_in, fs_out, urlpath_out)
-            else:
-                _store_io_object(obj, fs_out, urlpath_out)
+        if urlpath_tmp is not None:
+            # Temporary files are NOT uploaded with their content type
+            filetype = filetype or _guess_type(fs_in, urlpath_in)
+            # Locked files are NOT deleted by cleaners
+            stack.enter_context(utils.FileLock(fs_out, urlpath_tmp, timeout=None))
+            try:
+                root = _store_content_addressed_file(
+                    fs_in, urlpath_in, fs_out, urlpath_tmp, compression=compression
+                )
+            except BaseException:
+                if fs_out.exists(urlpath_tmp):
+                    fs_out.rm(urlpath_tmp)
+                raise
+            urlpath_out = posixpath.join(cache_files_urlpath, f"{root}{ext}")
 
-        file_json = _dictify_file(fs_out, urlpath_out)
+        with utils.FileLock(
+            fs_out, urlpath_out, timeout=_get_lock_timeout(settings)
+        ) as file_exists:
+            if urlpath_tmp is not None:
+                if file_exists:
+                    fs_out.rm(urlpath_tmp)
+                else:
+                    fs_out.mv(urlpath_tmp, urlpath_out)
+            elif not (file_exists or is_in_place):
+                _store_file_object(
+                    fs_in,
+                    urlpath_in,
+                    fs_out,
+                    urlpath_out,
+                    io_delete_original=io_delete_original,
+                    content_type=content_type,
+                    compression=compression,
+                )
+
+            file_json = _dictify_file(fs_out, urlpath_out, filetype=filetype)
+            if compression:
+                file_json["file:compression"] = compression
+
+    return encode.dictify_python_call(
+        decode_io_object,
+        file_json,
+        storage_options=settings.cache_files_storage_options,
+        **_get_open_kwargs(obj),
+    )
 
-        params = inspect.signature(open).parameters
-        kwargs = {k: getattr(obj, k) for k in params.keys() if hasattr(obj, k)}
 
-        return encode.dictify_python_call(
-            decode_io_object,
-            file_json,
-            storage_options=settings.cache_files_storage_options,
-            **kwargs,
+def fingerprint_io_object(obj: _UNION_IO_TYPES) -> dict[str, Any]:
+    """Fingerprint a file object for hashing (the file is NOT copied)."""
+    fingerprint: dict[str, Any] = {"type": "io_fingerprint"}
+    if urlpath := getattr(obj, "path", getattr(obj, "name", "")):
+        fs = getattr(obj, "fs", fsspec.filesystem("file"))
+        fingerprint.update(
+            {
+                "urlpath": fs.unstrip_protocol(urlpath),
+                "file:checksum": f"{fs.checksum(urlpath):x}",
+                "file:size": fs.size(urlpath),
+            }
         )
+    else:
+        if not obj.seekable():
+            raise ValueError(f"can NOT fingerprint a non-seekable stream: {obj!r}")
+        position = obj.tell()
+        md5 = hashlib.md5()
+        size = 0
+        try:
+            while data := obj.read(io.DEFAULT_BUFFER_SIZE):
+                data = data if isinstance(data, bytes) else data.encode()
+                md5.update(data)
+                size += len(data)
+        finally:
+            obj.seek(position)
+        fingerprint.update({"file:checksum": md5.hexdigest(), "file:size": size})
+    fingerprint["kwargs"] = _get_open_kwargs(obj)
+    return fingerprint
 
 
 def register_all() -> None:
@@ -452,6 +1152,9 @@ def register_all() -> None:
         fsspec.implementations.local.LocalFileOpener,
     ):
         encode.FILECACHE_ENCODERS.append((type_, dictify_io_object))
+        encode.HASH_ENCODERS.append((type_, fingerprint_io_object))
     if _HAS_XARRAY_AND_DASK:
-        for type_ in (xr.Dataset, xr.DataArray):
+        # Resolved when xarray is imported
+        for type_ in ("xarray.Dataset", "xarray.DataArray"):
             encode.FILECACHE_ENCODERS.append((type_, dictify_xr_object))
+            encode.HASH_ENCODERS.append((type_, fingerprint_xr_object))
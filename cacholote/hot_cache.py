@@ -0,0 +1,266 @@
+"""Host-level cache of hot results shared between processes."""
+
+# Copyright 2023, European Union.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+
+import datetime
+import functools
+import mmap
+import os
+import struct
+import threading
+import time
+
+from . import config, stores, utils
+
+_MAGIC = b"CACHOHC1"
+# magic, number of slots, slot size, hits flushed at
+_HEADER = struct.Struct("<8sQQd")
+_FLUSHED_AT = struct.Struct("<d")
+_FLUSHED_AT_OFFSET = 24
+_HEADER_SIZE = 64
+# sequence, key, entry id, expiration, stored at, hits, size of the result
+_SLOT_HEADER = struct.Struct("<Q32sqddII")
+_SEQUENCE = struct.Struct("<Q")
+_HITS = struct.Struct("<I")
+_HITS_OFFSET = 64
+_KEY_SIZE = 32
+_EMPTY_KEY = b"\0" * _KEY_SIZE
+
+_FLUSH_LOCK = threading.Lock()
+_FLUSH_THREAD: threading.Thread | None = None
+
+
+class HotCache:
+    """Fixed-size table of JSON serialized results in a memory-mapped file.
+
+    Each key can be stored in one of two slots, and new results evict the least hit
+    (or invalid) one. Readers do not take locks: slots are versioned by a sequence
+    number (seqlock) and torn reads are considered misses. Writers are serialized
+    with a file lock. Hits are counted in slots, and counts are returned when slots
+    are overwritten or popped (every ``ttl`` seconds).
+
+    Parameters
+    ----------
+    path: str, PathLike
+        Path of the cache file. The geometry of existing files is preserved.
+    size: int
+        Size of new cache files in bytes.
+    max_item_size: int
+        Maximum size of results in bytes.
+    ttl: float
+        Seconds after which stored results must be revalidated.
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        size: int = 64 * 2**20,
+        max_item_size: int = 4 * 2**10,
+        ttl: float = 60,
+    ) -> None:
+        self.path = os.fspath(path)
+        self.lockfile = self.path + ".lock"
+        self.size = size
+        self.max_item_size = max_item_size
+        self.ttl = ttl
+        self._mmap: mmap.mmap | None = None
+        self._n_slots = 0
+        self._slot_size = 0
+
+    def _get_mmap(self) -> mmap.mmap:
+        if self._mmap is None:
+            with utils._flock(self.lockfile):
+                if not os.path.exists(self.path):
+                    slot_size = -(-(_SLOT_HEADER.size + self.max_item_size) // 64) * 64
+                    n_slots = max(2, (self.size - _HEADER_SIZE) // slot_size)
+                    tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        header = _HEADER.pack(_MAGIC, n_slots, slot_size, time.time())
+                        f.write(header.ljust(_HEADER_SIZE, b"\0"))
+                        f.truncate(_HEADER_SIZE + n_slots * slot_size)
+                    os.replace(tmp_path, self.path)
+                with open(self.path, "r+b") as f:
+                    mm = mmap.mmap(f.fileno(), 0)
+            magic, self._n_slots, self._slot_size, _ = _HEADER.unpack_from(mm)
+            if magic != _MAGIC:
+                raise ValueError(f"{self.path!r} is not a cacholote hot cache.")
+            self._mmap = mm
+        return self._mmap
+
+    def _get_offsets(self, key: str) -> tuple[int, ...]:
+        # Keys are uniformly distributed hex digests
+        indices = {int(key[:16], 16) % self._n_slots, int(key[16:], 16) % self._n_slots}
+        return tuple(_HEADER_SIZE + index * self._slot_size for index in indices)
+
+    def get(self, key: str, expiration: datetime.datetime | None = None) -> str | None:
+        """Return the result of a valid entry, None if it is not stored."""
+        if len(key) != _KEY_SIZE:
+            return None
+        mm = self._get_mmap()
+        encoded_key = key.encode()
+        now = time.time()
+        for offset in self._get_offsets(key):
+            sequence, slot_key, _, slot_expiration, stored_at, hits, size = (
+                _SLOT_HEADER.unpack_from(mm, offset)
+            )
+            if (
+                sequence & 1
+                or slot_key != encoded_key
+                or slot_expiration <= now
+                or now - stored_at >= self.ttl
+                or (
+                    expiration is not None
+                    and slot_expiration != stores._to_timestamp(expiration)
+                )
+            ):
+                continue
+            start = offset + _SLOT_HEADER.size
+            result = mm[start : start + size]
+            if _SEQUENCE.unpack_from(mm, offset)[0] != sequence:
+                # Overwritten while reading
+                continue
+            # Approximate: concurrent increments might be lost
+            _HITS.pack_into(mm, offset + _HITS_OFFSET, hits + 1)
+            return result.decode()
+        return None
+
+    def put(
+        self, key: str, entry_id: int, expiration: datetime.datetime, result: str
+    ) -> list[tuple[str, int, int]]:
+        """Store the result of an entry.
+
+        Return keys, ids and hits of the entries overwritten (hits must be flushed).
+        """
+        data = result.encode()
+        if len(key) != _KEY_SIZE or len(data) > self.max_item_size:
+            return []
+        mm = self._get_mmap()
+        if len(data) > self._slot_size - _SLOT_HEADER.size:
+            return []
+
+        encoded_key = key.encode()
+        now = time.time()
+        with utils._flock(self.lockfile):
+            slots = []
+            for offset in self._get_offsets(key):
+                sequence, slot_key, slot_id, slot_expiration, stored_at, hits, _ = (
+                    _SLOT_HEADER.unpack_from(mm, offset)
+                )
+                is_valid = slot_expiration > now and now - stored_at < self.ttl
+                rank = (slot_key != encoded_key, hits if is_valid else -1, stored_at)
+                slots.append((rank, offset, sequence, slot_key, slot_id, hits))
+            _, offset, sequence, slot_key, slot_id, hits = min(slots)
+
+            _SEQUENCE.pack_into(mm, offset, sequence + 1)
+            _SLOT_HEADER.pack_into(
+                mm,
+                offset,
+                sequence + 1,
+                encoded_key,
+                entry_id,
+                stores._to_timestamp(expiration),
+                now,
+                0,
+                len(data),
+            )
+            start = offset + _SLOT_HEADER.size
+            mm[start : start + len(data)] = data
+            _SEQUENCE.pack_into(mm, offset, sequence + 2)
+        return [(slot_key.decode(), slot_id, hits)] if hits else []
+
+    def discard(self, key: str) -> None:
+        """Invalidate the results of a key."""
+        if len(key) != _KEY_SIZE:
+            return
+        mm = self._get_mmap()
+        encoded_key = key.encode()
+        with utils._flock(self.lockfile):
+            for offset in self._get_offsets(key):
+                sequence, slot_key, *_ = _SLOT_HEADER.unpack_from(mm, offset)
+                if slot_key == encoded_key:
+                    _SEQUENCE.pack_into(mm, offset, sequence + 1)
+                    mm[
+                        offset + _SEQUENCE.size : offset + _SEQUENCE.size + _KEY_SIZE
+                    ] = _EMPTY_KEY
+                    _SEQUENCE.pack_into(mm, offset, sequence + 2)
+
+    def _get_flushed_at(self, mm: mmap.mmap) -> float:
+        flushed_at: float = _FLUSHED_AT.unpack_from(mm, _FLUSHED_AT_OFFSET)[0]
+        return flushed_at
+
+    def is_flush_due(self) -> bool:
+        """Whether hits have NOT been popped in the last ``ttl`` seconds."""
+        return time.time() - self._get_flushed_at(self._get_mmap()) >= self.ttl
+
+    def pop_hits(self) -> list[tuple[str, int, int]]:
+        """Reset hit counters when a flush is due.
+
+        Return keys, ids and hits of the entries hit (hits must be flushed).
+        """
+        mm = self._get_mmap()
+        popped = []
+        with utils._flock(self.lockfile):
+            # Only one process pops hits every ttl
+            if not self.is_flush_due():
+                return []
+            _FLUSHED_AT.pack_into(mm, _FLUSHED_AT_OFFSET, time.time())
+            for index in range(self._n_slots):
+                offset = _HEADER_SIZE + index * self._slot_size
+                _, slot_key, slot_id, *_, hits, _ = _SLOT_HEADER.unpack_from(mm, offset)
+                if hits and slot_key != _EMPTY_KEY:
+                    # Approximate: concurrent increments might be lost
+                    _HITS.pack_into(mm, offset + _HITS_OFFSET, 0)
+                    popped.append((slot_key.decode(), slot_id, hits))
+        return popped
+
+
+def _flush_hits(hot: HotCache, settings: config.Settings) -> None:
+    try:
+        for key, entry_id, hits in hot.pop_hits():
+            settings.get_metadata_store(key).touch_entry(entry_id, count=hits)
+    except Exception as ex:
+        settings.logger.warning("can NOT flush hot cache hits", error=repr(ex))
+    finally:
+        _FLUSH_LOCK.release()
+
+
+def flush_hits_in_background(hot: HotCache, settings: config.Settings) -> None:
+    """Flush hits to the metadata store every ``ttl`` seconds, in background."""
+    global _FLUSH_THREAD
+    if hot.is_flush_due() and _FLUSH_LOCK.acquire(blocking=False):
+        _FLUSH_THREAD = threading.Thread(
+            target=_flush_hits,
+            args=(hot, settings),
+            name="cacholote-hot-cache",
+            daemon=True,
+        )
+        _FLUSH_THREAD.start()
+
+
+@functools.lru_cache()
+def _get_hot_cache(path: str, size: int, max_item_size: int, ttl: float) -> HotCache:
+    return HotCache(path, size=size, max_item_size=max_item_size, ttl=ttl)
+
+
+def get_hot_cache(settings: config.Settings) -> HotCache | None:
+    if settings.hot_cache_path is None:
+        return None
+    return _get_hot_cache(
+        settings.hot_cache_path,
+        settings.hot_cache_size,
+        settings.hot_cache_max_item_size,
+        settings.hot_cache_ttl,
+    )
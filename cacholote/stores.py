@@ -0,0 +1,705 @@
+"""Metadata stores for the index of cache entries."""
+
+# Copyright 2023, European Union.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+
+import abc
+import collections
+import contextlib
+import datetime
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import warnings
+from collections.abc import Collection, Iterator
+from typing import Any, Optional
+
+import sqlalchemy as sa
+import sqlalchemy.orm
+
+from . import database, utils
+
+_SELECT_CACHE_ENTRIES = (
+    database._select_with_result(
+        database.CacheEntry.id,
+        database.CacheEntry.expiration,
+    )
+    .filter(
+        database.CacheEntry.key == sa.bindparam("key"),
+        database.CacheEntry.expiration > sa.bindparam("now"),
+    )
+    .order_by(database.CacheEntry.updated_at.desc())
+)
+_SELECT_CACHE_ENTRIES_WITH_EXPIRATION = _SELECT_CACHE_ENTRIES.filter(
+    # When expiration is provided, only get entries with matching expiration
+    database.CacheEntry.expiration == sa.bindparam("expiration")
+)
+_UPDATE_CACHE_ENTRY = (
+    sa.update(database.CacheEntry)
+    .where(database.CacheEntry.id == sa.bindparam("entry_id"))
+    .values(
+        counter=sa.func.coalesce(database.CacheEntry.counter, 0) + sa.bindparam("count")
+    )
+)
+_UPDATE_CACHE_ENTRY_WITH_TAG = _UPDATE_CACHE_ENTRY.values(tag=sa.bindparam("tag"))
+
+# Keys recently inserted by the process: key -> monotonic time
+_RECENT_INSERTS: collections.OrderedDict[str, float] = collections.OrderedDict()
+_RECENT_INSERTS_LOCK = threading.Lock()
+
+_SQLITE_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    expiration REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    counter INTEGER NOT NULL,
+    tag TEXT,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_cache_entries_key ON cache_entries (key, updated_at);
+CREATE TABLE IF NOT EXISTS pending_touches (
+    id INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL,
+    tag TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+_SQLITE_STORE_COLUMNS = (
+    "id",
+    "key",
+    "expiration",
+    "created_at",
+    "updated_at",
+    "counter",
+    "tag",
+    "result",
+)
+
+
+class MetadataStore(abc.ABC):
+    """Index of cache entries.
+
+    Entries are ``cacholote.database.CacheEntry`` objects NOT attached to any session.
+    Results are JSON serialized strings.
+    """
+
+    @abc.abstractmethod
+    def get_results(
+        self, key: str, expiration: datetime.datetime | None = None
+    ) -> Iterator[tuple[int, datetime.datetime, str]]:
+        """Iterate over valid entries, most recently updated first.
+
+        Yield ids, expirations (naive UTC) and results of entries.
+        If ``expiration`` is not None, only entries with matching expiration are valid.
+        """
+
+    @abc.abstractmethod
+    def get_entry(self, entry_id: int) -> database.CacheEntry | None:
+        """Return an entry, None if it does not exist."""
+
+    @abc.abstractmethod
+    def iter_entries(self, key: str | None = None) -> Iterator[database.CacheEntry]:
+        """Iterate over all entries (including expired ones), optionally by key."""
+
+    @abc.abstractmethod
+    def add_entry(self, cache_entry: database.CacheEntry) -> int:
+        """Insert a new entry and return its id."""
+
+    @abc.abstractmethod
+    def touch_entry(
+        self, entry_id: int, tag: str | None = None, count: int = 1
+    ) -> bool:
+        """Increment the counter and update the tag (if not None) of an entry.
+
+        Return False if the entry does not exist.
+        """
+
+    @abc.abstractmethod
+    def expire_entries(
+        self, expiration: datetime.datetime, *entry_ids: int
+    ) -> None: ...
+
+    @abc.abstractmethod
+    def delete_entries(self, *entry_ids: int) -> None: ...
+
+    def iter_updated_entries(
+        self,
+        since: datetime.datetime | None = None,
+        keys: Collection[str] | None = None,
+    ) -> Iterator[database.CacheEntry]:
+        """Iterate over entries updated at or after ``since``, optionally by keys."""
+        for cache_entry in self.iter_entries():
+            if keys is not None and cache_entry.key not in keys:
+                continue
+            updated_at = cache_entry.updated_at
+            if since is None or (updated_at is not None and updated_at >= since):
+                yield cache_entry
+
+    def get_existing_ids(self, *entry_ids: int) -> set[int]:
+        """Return the ids of the entries that exist."""
+        return {
+            entry_id for entry_id in entry_ids if self.get_entry(entry_id) is not None
+        }
+
+    def get_referenced_files(self, *local_paths: str) -> set[str]:
+        """Return the cache files (local paths) still referenced by entries.
+
+        Stores that do not count references return an empty set: cache files are
+        removed together with any entry referencing them.
+        """
+        return set()
+
+
+class SQLAlchemyStore(MetadataStore):
+    """Store entries in a SQLAlchemy database (default).
+
+    Lookups are routed to the read-only replica (if any). Lookups of keys inserted by
+    the process in the last ``replica_lag`` seconds fall back to the primary database
+    on misses. If ``deduplicate_results`` is True, identical results of different
+    entries are stored once.
+    """
+
+    def __init__(
+        self,
+        sessionmaker: sa.orm.sessionmaker[sa.orm.Session],
+        readonly_sessionmaker: Optional[sa.orm.sessionmaker[sa.orm.Session]] = None,
+        deduplicate_results: bool = False,
+        replica_lag: float = 10,
+    ) -> None:
+        self.sessionmaker = sessionmaker
+        self.readonly_sessionmaker = readonly_sessionmaker
+        self.deduplicate_results = deduplicate_results
+        self.replica_lag = replica_lag
+
+    def _remember_insert(self, key: str) -> None:
+        now = time.monotonic()
+        with _RECENT_INSERTS_LOCK:
+            _RECENT_INSERTS[key] = now
+            _RECENT_INSERTS.move_to_end(key)
+            while next(iter(_RECENT_INSERTS.values())) < now - self.replica_lag:
+                _RECENT_INSERTS.popitem(last=False)
+
+    def _is_recent_insert(self, key: str) -> bool:
+        with _RECENT_INSERTS_LOCK:
+            inserted_at = _RECENT_INSERTS.get(key)
+        return (
+            inserted_at is not None
+            and time.monotonic() - inserted_at < self.replica_lag
+        )
+
+    def get_results(
+        self, key: str, expiration: datetime.datetime | None = None
+    ) -> Iterator[tuple[int, datetime.datetime, str]]:
+        params: dict[str, Any] = {"key": key, "now": utils.utcnow()}
+        if expiration:
+            params["expiration"] = expiration
+            select_stmt = _SELECT_CACHE_ENTRIES_WITH_EXPIRATION
+        else:
+            select_stmt = _SELECT_CACHE_ENTRIES
+
+        sessionmakers = [self.sessionmaker]
+        if self.readonly_sessionmaker is not None:
+            sessionmakers.insert(0, self.readonly_sessionmaker)
+        for i, sessionmaker in enumerate(sessionmakers):
+            if i and not self._is_recent_insert(key):
+                # Replicas might lag only behind recent inserts
+                break
+            with database._get_engine(sessionmaker).connect() as conn:
+                rows = conn.execute(select_stmt, params).all()
+            for entry_id, entry_expiration, result in rows:
+                yield entry_id, entry_expiration, json.dumps(result)
+
+    def get_entry(self, entry_id: int) -> database.CacheEntry | None:
+        with self.sessionmaker() as session:
+            return session.get(database.CacheEntry, entry_id)
+
+    def iter_entries(self, key: str | None = None) -> Iterator[database.CacheEntry]:
+        stmt = sa.select(database.CacheEntry)
+        if key is not None:
+            stmt = stmt.filter(database.CacheEntry.key == key)
+        with self.sessionmaker() as session:
+            yield from session.scalars(stmt)
+
+    def add_entry(self, cache_entry: database.CacheEntry) -> int:
+        with self.sessionmaker() as session:
+            database._begin_immediate(session)
+            database._add_file_references(session, cache_entry.result)
+            if self.deduplicate_results:
+                database._share_result(session, cache_entry)
+            session.add(cache_entry)
+            session.flush()
+            entry_id = cache_entry.id
+            key = cache_entry.key
+            database._commit_or_rollback(session)
+        if self.readonly_sessionmaker is not None and key is not None:
+            self._remember_insert(key)
+        assert isinstance(entry_id, int)
+        return entry_id
+
+    def touch_entry(
+        self, entry_id: int, tag: str | None = None, count: int = 1
+    ) -> bool:
+        params: dict[str, Any] = {"entry_id": entry_id, "count": count}
+        with database._get_engine(self.sessionmaker).connect() as conn:
+            conn.execution_options(sqlite_begin="IMMEDIATE")
+            if tag is None:
+                update = conn.execute(_UPDATE_CACHE_ENTRY, params)
+            else:
+                update = conn.execute(
+                    _UPDATE_CACHE_ENTRY_WITH_TAG, params | {"tag": tag}
+                )
+            conn.commit()
+        return bool(update.rowcount)
+
+    def expire_entries(self, expiration: datetime.datetime, *entry_ids: int) -> None:
+        with self.sessionmaker() as session:
+            database._begin_immediate(session)
+            session.execute(
+                sa.update(database.CacheEntry)
+                .where(database.CacheEntry.id.in_(entry_ids))
+                .values(expiration=expiration)
+            )
+            database._commit_or_rollback(session)
+
+    def delete_entries(self, *entry_ids: int) -> None:
+        with self.sessionmaker() as session:
+            database._begin_immediate(session)
+            rows = session.execute(
+                database._select_with_result(database.CacheEntry.result_digest)
+                .where(database.CacheEntry.id.in_(entry_ids))
+                .with_for_update(of=database.CacheEntry)
+            ).all()
+            session.execute(
+                sa.delete(database.CacheEntry).where(
+                    database.CacheEntry.id.in_(entry_ids)
+                )
+            )
+            database._remove_file_references(session, *[row[1] for row in rows])
+            database._remove_result_references(session, *[row[0] for row in rows])
+            database._commit_or_rollback(session)
+
+    def iter_updated_entries(
+        self,
+        since: datetime.datetime | None = None,
+        keys: Collection[str] | None = None,
+    ) -> Iterator[database.CacheEntry]:
+        stmt = sa.select(database.CacheEntry)
+        if since is not None:
+            stmt = stmt.filter(database.CacheEntry.updated_at >= since)
+        if keys is not None:
+            stmt = stmt.filter(database.CacheEntry.key.in_(keys))
+        with self.sessionmaker() as session:
+            yield from session.scalars(stmt)
+
+    def get_existing_ids(self, *entry_ids: int) -> set[int]:
+        stmt = sa.select(database.CacheEntry.id).filter(
+            database.CacheEntry.id.in_(entry_ids)
+        )
+        with self.sessionmaker() as session:
+            return set(session.scalars(stmt))
+
+    def get_referenced_files(self, *local_paths: str) -> set[str]:
+        with self.sessionmaker() as session:
+            return database._get_referenced_files(session, *local_paths)
+
+
+def _to_timestamp(value: datetime.datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.timestamp()
+
+
+def _from_timestamp(value: float) -> datetime.datetime:
+    # Naive UTC datetimes, same as SQLAlchemy DateTime columns
+    return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc).replace(
+        tzinfo=None
+    )
+
+
+class SQLiteStore(MetadataStore):
+    """Store entries in an embedded SQLite key-value table without ORM overhead.
+
+    Designed for single-host read-mostly workloads: point lookups by key use an
+    index of a memory-mapped database, and each thread uses its own connection.
+
+    Parameters
+    ----------
+    path: str, PathLike
+        Path of the SQLite database file.
+    """
+
+    def __init__(self, path: str | os.PathLike[str]) -> None:
+        self.path = os.fspath(path)
+        self._local = threading.local()
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        if getattr(self._local, "pid", None) != os.getpid():
+            # Connections are NOT shared with forked processes
+            conn = sqlite3.connect(
+                self.path,
+                timeout=database._SQLITE_BUSY_TIMEOUT,
+                isolation_level=None,
+            )
+            for name, value in database._SQLITE_PRAGMAS.items():
+                conn.execute(f"PRAGMA {name}={value}")
+            conn.executescript(_SQLITE_STORE_SCHEMA)
+            self._local.connection = conn
+            self._local.pid = os.getpid()
+        connection: sqlite3.Connection = self._local.connection
+        return connection
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _row_to_entry(row: tuple[Any, ...]) -> database.CacheEntry:
+        values = dict(zip(_SQLITE_STORE_COLUMNS, row))
+        for name in ("expiration", "created_at", "updated_at"):
+            values[name] = _from_timestamp(values[name])
+        values["result"] = json.loads(values["result"])
+        return database.CacheEntry(**values)
+
+    def get_results(
+        self, key: str, expiration: datetime.datetime | None = None
+    ) -> Iterator[tuple[int, datetime.datetime, str]]:
+        query = (
+            "SELECT id, expiration, result FROM cache_entries"
+            " WHERE key = ? AND expiration > ?"
+        )
+        params: list[Any] = [key, _to_timestamp(utils.utcnow())]
+        if expiration:
+            query += " AND expiration = ?"
+            params.append(_to_timestamp(expiration))
+        query += " ORDER BY updated_at DESC"
+        for entry_id, entry_expiration, result in self._connection.execute(
+            query, params
+        ).fetchall():
+            yield entry_id, _from_timestamp(entry_expiration), result
+
+    def get_entry(self, entry_id: int) -> database.CacheEntry | None:
+        row = self._connection.execute(
+            f"SELECT {', '.join(_SQLITE_STORE_COLUMNS)} FROM cache_entries WHERE id = ?",
+            (entry_id,),
+        ).fetchone()
+        return None if row is None else self._row_to_entry(row)
+
+    def iter_entries(self, key: str | None = None) -> Iterator[database.CacheEntry]:
+        query = f"SELECT {', '.join(_SQLITE_STORE_COLUMNS)} FROM cache_entries"
+        params: tuple[Any, ...] = ()
+        if key is not None:
+            query += " WHERE key = ?"
+            params = (key,)
+        for row in self._connection.execute(query, params).fetchall():
+            yield self._row_to_entry(row)
+
+    def add_entry(self, cache_entry: database.CacheEntry) -> int:
+        now = utils.utcnow()
+        expiration = cache_entry.expiration or database._DATETIME_MAX
+        if _to_timestamp(expiration) < now.timestamp():
+            warnings.warn(f"Expiration date has passed. {expiration=}", UserWarning)
+        cursor = self._connection.execute(
+            "INSERT INTO cache_entries"
+            " (key, expiration, created_at, updated_at, counter, tag, result)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                cache_entry.key,
+                _to_timestamp(expiration),
+                now.timestamp(),
+                now.timestamp(),
+                cache_entry.counter or 0,
+                cache_entry.tag,
+                cache_entry._result_as_string,
+            ),
+        )
+        assert cursor.lastrowid is not None
+        return cursor.lastrowid
+
+    def touch_entry(
+        self, entry_id: int, tag: str | None = None, count: int = 1
+    ) -> bool:
+        cursor = self._connection.execute(
+            "UPDATE cache_entries"
+            " SET counter = counter + ?, updated_at = ?, tag = COALESCE(?, tag)"
+            " WHERE id = ?",
+            (count, utils.utcnow().timestamp(), tag, entry_id),
+        )
+        return bool(cursor.rowcount)
+
+    def expire_entries(self, expiration: datetime.datetime, *entry_ids: int) -> None:
+        self._connection.execute(
+            "UPDATE cache_entries SET expiration = ?"
+            " WHERE id IN (SELECT value FROM json_each(?))",
+            (_to_timestamp(expiration), json.dumps(entry_ids)),
+        )
+
+    def delete_entries(self, *entry_ids: int) -> None:
+        with self._transaction() as conn:
+            for table in ("cache_entries", "pending_touches"):
+                conn.execute(
+                    f"DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))",
+                    (json.dumps(entry_ids),),
+                )
+
+    def upsert_entries(self, *cache_entries: database.CacheEntry) -> None:
+        """Insert or replace entries, preserving their ids and timestamps."""
+        now = utils.utcnow()
+        rows = []
+        for cache_entry in cache_entries:
+            values = {
+                name: getattr(cache_entry, name) for name in _SQLITE_STORE_COLUMNS
+            }
+            values["expiration"] = values["expiration"] or database._DATETIME_MAX
+            for name in ("expiration", "created_at", "updated_at"):
+                values[name] = _to_timestamp(values[name] or now)
+            values["counter"] = values["counter"] or 0
+            values["result"] = cache_entry._result_as_string
+            rows.append(tuple(values.values()))
+        with self._transaction() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO cache_entries ({', '.join(_SQLITE_STORE_COLUMNS)})"
+                f" VALUES ({', '.join('?' * len(_SQLITE_STORE_COLUMNS))})",
+                rows,
+            )
+
+    def _buffer_touch(self, entry_id: int, tag: str | None = None) -> bool:
+        with self._transaction() as conn:
+            if not self.touch_entry(entry_id, tag=tag):
+                return False
+            conn.execute(
+                "INSERT INTO pending_touches (id, count, tag) VALUES (?, 1, ?)"
+                " ON CONFLICT (id) DO UPDATE"
+                " SET count = count + 1, tag = COALESCE(excluded.tag, tag)",
+                (entry_id, tag),
+            )
+        return True
+
+    def _get_pending_touches(self) -> list[tuple[int, int, str | None]]:
+        return self._connection.execute(
+            "SELECT id, count, tag FROM pending_touches"
+        ).fetchall()
+
+    def _ack_pending_touches(self, *touches: tuple[int, int, str | None]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE pending_touches SET count = count - ? WHERE id = ?",
+                [(count, entry_id) for entry_id, count, _ in touches],
+            )
+            conn.execute("DELETE FROM pending_touches WHERE count <= 0")
+
+    def _get_state(self, name: str) -> float | None:
+        row = self._connection.execute(
+            "SELECT value FROM sync_state WHERE name = ?", (name,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _set_state(self, name: str, value: float) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)",
+            (name, value),
+        )
+
+    def _claim_sync(self, interval: float) -> bool:
+        # Only one process of the node syncs every interval
+        now = utils.utcnow().timestamp()
+        with self._transaction():
+            synced_at = self._get_state("synced_at")
+            if synced_at is not None and now - synced_at < interval:
+                return False
+            self._set_state("synced_at", now)
+        return True
+
+
+class TieredStore(MetadataStore):
+    """Node-local index of recently used entries in front of a central store.
+
+    Lookups are served by the local store, falling back to the central store on
+    local misses (entries found are copied to the local store). Writes go through to
+    the central store, whereas counters of local hits are buffered and flushed on sync.
+
+    Every ``sync_interval`` seconds, one process of the node pulls in background the
+    central entries updated since the last sync (``updated_at`` watermark) whose keys
+    are used on this node, and drops local entries that have been deleted or expired.
+
+    Parameters
+    ----------
+    central: MetadataStore
+        Authoritative store shared by all nodes.
+    local: SQLiteStore
+        Node-local store.
+    sync_interval: float, default: 60
+        Seconds between incremental syncs.
+    sync_overlap: float, default: 60
+        Seconds re-scanned before the watermark, to tolerate clock skew
+        and long-running transactions.
+    """
+
+    def __init__(
+        self,
+        central: MetadataStore,
+        local: SQLiteStore,
+        sync_interval: float = 60,
+        sync_overlap: float = 60,
+    ) -> None:
+        self.central = central
+        self.local = local
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        self._sync_thread: threading.Thread | None = None
+
+    def _sync_in_background(self) -> None:
+        try:
+            self.sync()
+        except Exception as ex:
+            warnings.warn(f"can NOT sync {self.local.path!r}: {ex!r}", UserWarning)
+
+    def get_results(
+        self, key: str, expiration: datetime.datetime | None = None
+    ) -> Iterator[tuple[int, datetime.datetime, str]]:
+        if self.local._claim_sync(self.sync_interval):
+            # Syncs do NOT slow down lookups
+            self._sync_thread = threading.Thread(
+                target=self._sync_in_background, name="cacholote-sync", daemon=True
+            )
+            self._sync_thread.start()
+
+        results = list(self.local.get_results(key, expiration))
+        if not results:
+            now = utils.utcnow().replace(tzinfo=None)
+            self.local.upsert_entries(
+                *[
+                    cache_entry
+                    for cache_entry in self.central.iter_entries(key=key)
+                    if cache_entry.expiration is None or cache_entry.expiration > now
+                ]
+            )
+            results = list(self.local.get_results(key, expiration))
+        yield from results
+
+    def get_entry(self, entry_id: int) -> database.CacheEntry | None:
+        return self.local.get_entry(entry_id) or self.central.get_entry(entry_id)
+
+    def iter_entries(self, key: str | None = None) -> Iterator[database.CacheEntry]:
+        return self.central.iter_entries(key=key)
+
+    def add_entry(self, cache_entry: database.CacheEntry) -> int:
+        entry_id = self.central.add_entry(cache_entry)
+        if (central_entry := self.central.get_entry(entry_id)) is not None:
+            self.local.upsert_entries(central_entry)
+        return entry_id
+
+    def touch_entry(
+        self, entry_id: int, tag: str | None = None, count: int = 1
+    ) -> bool:
+        if count == 1 and self.local._buffer_touch(entry_id, tag=tag):
+            return True
+        return self.central.touch_entry(entry_id, tag=tag, count=count)
+
+    def expire_entries(self, expiration: datetime.datetime, *entry_ids: int) -> None:
+        self.central.expire_entries(expiration, *entry_ids)
+        self.local.expire_entries(expiration, *entry_ids)
+
+    def delete_entries(self, *entry_ids: int) -> None:
+        self.central.delete_entries(*entry_ids)
+        self.local.delete_entries(*entry_ids)
+
+    def iter_updated_entries(
+        self,
+        since: datetime.datetime | None = None,
+        keys: Collection[str] | None = None,
+    ) -> Iterator[database.CacheEntry]:
+        return self.central.iter_updated_entries(since, keys=keys)
+
+    def get_existing_ids(self, *entry_ids: int) -> set[int]:
+        return self.central.get_existing_ids(*entry_ids)
+
+    def get_referenced_files(self, *local_paths: str) -> set[str]:
+        return self.central.get_referenced_files(*local_paths)
+
+    def sync(self, batch_size: int = 500) -> None:
+        """Flush buffered counters and pull changes from the central store."""
+        touches = self.local._get_pending_touches()
+        for entry_id, count, tag in touches:
+            self.central.touch_entry(entry_id, tag=tag, count=count)
+        self.local._ack_pending_touches(*touches)
+
+        conn = self.local._connection
+        synced_at = utils.utcnow().timestamp()
+        # Entries used before the first sync are read through on demand
+        if (watermark := self.local._get_state("watermark")) is not None:
+            since = _from_timestamp(watermark - self.sync_overlap)
+            keys = [
+                key for (key,) in conn.execute("SELECT DISTINCT key FROM cache_entries")
+            ]
+            for i in range(0, len(keys), batch_size):
+                self.local.upsert_entries(
+                    *self.central.iter_updated_entries(
+                        since, keys=keys[i : i + batch_size]
+                    )
+                )
+        self.local._set_state("watermark", synced_at)
+
+        # Tombstones
+        now = _to_timestamp(utils.utcnow())
+        conn.execute("DELETE FROM cache_entries WHERE expiration <= ?", (now,))
+        entry_ids = [
+            entry_id for (entry_id,) in conn.execute("SELECT id FROM cache_entries")
+        ]
+        for i in range(0, len(entry_ids), batch_size):
+            batch = entry_ids[i : i + batch_size]
+            existing_ids = self.central.get_existing_ids(*batch)
+            self.local.delete_entries(*set(batch) - existing_ids)
+
+
+@functools.lru_cache()
+def _get_sqlite_store(path: str) -> SQLiteStore:
+    return SQLiteStore(path)
+
+
+@functools.lru_cache()
+def _get_tiered_store(
+    sessionmaker: sa.orm.sessionmaker[sa.orm.Session],
+    readonly_sessionmaker: Optional[sa.orm.sessionmaker[sa.orm.Session]],
+    path: str,
+    sync_interval: float,
+    deduplicate_results: bool = False,
+    replica_lag: float = 10,
+) -> TieredStore:
+    return TieredStore(
+        SQLAlchemyStore(
+            sessionmaker,
+            readonly_sessionmaker=readonly_sessionmaker,
+            deduplicate_results=deduplicate_results,
+            replica_lag=replica_lag,
+        ),
+        _get_sqlite_store(path),
+        sync_interval=sync_interval,
+    )
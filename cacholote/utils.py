@@ -23,6 +23,7 @@ import functools
 import hashlib
 import io
 import os
+import shutil
 import time
 import warnings
 from types import TracebackType
@@ -32,6 +33,12 @@ import fsspec
 
 from . import config
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows: locks are NOT shared between processes
+    fcntl = None  # type: ignore[assignment]
+
 
 def hexdigestify(text: str) -> str:
     """Convert text to its hash made of hexadecimal digits."""
@@ -133,6 +140,53 @@ def utcnow() -> datetime.datetime:
     return datetime.datetime.now(tz=datetime.timezone.utc)
 
 
+@contextlib.contextmanager
+def _flock(path: str, blocking: bool = True) -> Iterator[bool]:
+    """Hold an exclusive lock of a local file, yield False if it can not be acquired."""
+    with open(path, "a") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Linux ioctl cloning files on copy-on-write filesystems (e.g., Btrfs, XFS)
+_FICLONE = 0x40049409
+
+
+def _clone_file(src: str, dst: str, strategy: str) -> str:
+    """Copy a local file, sharing its blocks when possible. Return the method used.
+
+    Strategies: "reflink" (copy-on-write clone), "auto" (reflink, then hard link),
+    and "copy". Files are copied when the strategy is NOT supported (e.g., source
+    and destination on different devices).
+    """
+    if strategy in ("reflink", "auto") and fcntl is not None:
+        try:
+            with open(src, "rb") as f_in, open(dst, "wb") as f_out:
+                fcntl.ioctl(f_out.fileno(), _FICLONE, f_in.fileno())
+            return "reflink"
+        except OSError:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(dst)
+    if strategy == "auto":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
 @contextlib.contextmanager
 def change_working_dir(working_dir: str) -> Iterator[str]:
     old_dir = os.getcwd()
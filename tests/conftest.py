@@ -47,7 +47,7 @@ def set_cache(
 ) -> Iterator[str]:
     param = getattr(request, "param", "file")
     if param.lower() == "cads":
-        database._cached_sessionmaker.cache_clear()
+        database._clear_sessionmakers()
         test_bucket_name = "test-bucket"
         client_kwargs = create_test_bucket(s3_server, test_bucket_name)
         with config.set(
@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
 import contextlib
 import datetime
 import os
 import pathlib
+import subprocess
+import sys
+import threading
 from typing import Any
 
+import fsspec
+import pydantic
 import pytest
 import sqlalchemy as sa
 
@@ -145,3 +152,89 @@ def test_create_engine_dict_kwargs() -> None:
     old_session_maker = config.get().instantiated_sessionmaker
     config.set(create_engine_kwargs={"connect_args": {"timeout": 30}})
     assert config.get().instantiated_sessionmaker is not old_session_maker
+
+
+def test_settings_are_immutable() -> None:
+    settings = config.get()
+    assert config.get() is settings
+    with pytest.raises(pydantic.ValidationError, match="frozen"):
+        settings.tag = "foo"
+
+
+def test_set_does_not_make_cache_dir_twice(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    calls = []
+    mkdirs = fsspec.implementations.local.LocalFileSystem.mkdirs
+
+    def counting_mkdirs(self: Any, *args: Any, **kwargs: Any) -> None:
+        calls.append(args)
+        mkdirs(self, *args, **kwargs)
+
+    monkeypatch.setattr(
+        fsspec.implementations.local.LocalFileSystem, "mkdirs", counting_mkdirs
+    )
+    with config.set(tag="foo"):
+        assert config.get().tag == "foo"
+    assert calls == []
+
+    with config.set(cache_files_urlpath=str(tmp_path / "new")):
+        with config.set(tag="foo"):
+            pass
+    assert len(calls) == 1
+    assert (tmp_path / "new").is_dir()
+
+
+def test_set_is_thread_safe() -> None:
+    barrier = threading.Barrier(2)
+    tags = {}
+
+    def target(tag: str) -> None:
+        with config.set(tag=tag):
+            barrier.wait()
+            tags[tag] = config.get().tag
+            barrier.wait()
+
+    threads = [threading.Thread(target=target, args=(tag,)) for tag in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tags == {"a": "a", "b": "b"}
+    assert config.get().tag is None
+
+
+def test_set_is_asyncio_safe() -> None:
+    async def get_tag(tag: str) -> str | None:
+        with config.set(tag=tag):
+            await asyncio.sleep(0.01)
+            return config.get().tag
+
+    async def main() -> list[str | None]:
+        return list(await asyncio.gather(get_tag("a"), get_tag("b")))
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert config.get().tag is None
+
+
+def test_set_is_inherited_by_thread_pools() -> None:
+    with config.set(tag="x"):
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            assert executor.submit(lambda: config.get().tag).result() == "x"
+    assert config.get().tag is None
+
+
+def test_get_from_thread_in_fresh_process() -> None:
+    code = (
+        "import threading\n"
+        "from cacholote import config\n"
+        "thread = threading.Thread(target=config.get)\n"
+        "thread.start()\n"
+        "thread.join()\n"
+        "assert config.get() is not None\n"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    assert process.returncode == 0, process.stderr
+    assert "AssertionError" not in process.stderr
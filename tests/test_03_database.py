@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import multiprocessing
+import pathlib
+import subprocess
+import sys
+from typing import Any
+
+import pytest
+import sqlalchemy as sa
+
+from cacholote import cache, config, database
+
+
+def cached_calls(cache_db_urlpath: str, cache_files_urlpath: str, n: int) -> None:
+    with config.set(
+        cache_db_urlpath=cache_db_urlpath, cache_files_urlpath=cache_files_urlpath
+    ):
+        for i in range(n):
+            assert cache.cacheable(str)(i % 10) == str(i % 10)
+
+
+def get_pool_id(queue: multiprocessing.Queue[int]) -> None:
+    engine = config.get().engine
+    with engine.connect():
+        pass
+    queue.put(id(engine.pool))
+
+
+def test_pool_status(tmp_path: pathlib.Path) -> None:
+    url = f"sqlite:///{tmp_path / 'prewarm.db'}"
+    with config.set(cache_db_urlpath=url, pool_prewarm=2) as settings:
+        engine = settings.engine
+        status = database.pool_status()[url]
+        assert status["pool"] == "QueuePool"
+        assert status["checkedin"] == 2
+        assert status["checkedout"] == 0
+
+        with engine.connect():
+            status = database.pool_status()[url]
+            assert status["checkedin"] == 1
+            assert status["checkedout"] == 1
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="fork not available"
+)
+def test_pools_are_disposed_after_fork() -> None:
+    cache.cacheable(len)("foo")
+    parent_pool_id = id(config.get().engine.pool)
+
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    process = ctx.Process(target=get_pool_id, args=(queue,))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert queue.get() != parent_pool_id
+    assert id(config.get().engine.pool) == parent_pool_id
+
+
+def test_pools_are_prewarmed_after_fork(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    url = f"sqlite:///{tmp_path / 'prewarm.db'}"
+    with config.set(cache_db_urlpath=url, pool_prewarm=1) as settings:
+        engine = settings.engine
+        pool = engine.pool
+
+        # Simulate fork not detected by os.register_at_fork
+        monkeypatch.setattr(database, "_PID", -1)
+        assert settings.engine is engine
+        assert engine.pool is not pool
+        assert database.pool_status()[url]["checkedin"] == 1
+
+
+def test_sqlite_profile(tmp_path: pathlib.Path) -> None:
+    url = f"sqlite:///{tmp_path / 'profile.db'}"
+    with config.set(cache_db_urlpath=url) as settings:
+        with settings.engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 30_000
+
+
+def test_sqlite_concurrent_processes(tmp_path: pathlib.Path) -> None:
+    url = f"sqlite:///{tmp_path / 'concurrent.db'}"
+    cache_files_urlpath = str(tmp_path / "cache_files")
+    nprocs, ncalls = 4, 50
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=cached_calls, args=(url, cache_files_urlpath, ncalls))
+        for _ in range(nprocs)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * nprocs
+
+    with config.set(cache_db_urlpath=url) as settings:
+        with settings.instantiated_sessionmaker() as session:
+            counter = session.scalar(sa.func.sum(database.CacheEntry.counter))
+    assert counter == nprocs * ncalls
+
+
+def test_lazy_imports(tmp_path: pathlib.Path) -> None:
+    url = f"sqlite:///{tmp_path / 'lazy.db'}"
+    code = f"""
+import sys
+from typing import Any
+import cacholote
+for name in ("alembic", "dask", "magic", "sqlalchemy_utils", "xarray"):
+    assert name not in sys.modules, name
+cacholote.init_database({url!r})
+"""
+    # Initialize
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+    # Up to date
+    code += "assert 'alembic' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_sqlite_begin_modes(tmp_path: pathlib.Path) -> None:
+    url = f"sqlite:///{tmp_path / 'begin.db'}"
+    statements: list[str] = []
+
+    def log_begin(conn: sa.Connection, cursor: Any, statement: str, *args: Any) -> None:
+        if statement.startswith("BEGIN"):
+            statements.append(statement)
+
+    with config.set(cache_db_urlpath=url) as settings:
+        sa.event.listen(settings.engine, "before_cursor_execute", log_begin)
+        try:
+            assert cache.cacheable(str)(1) == "1"  # miss: lookup + insert
+            assert cache.cacheable(str)(1) == "1"  # hit: lookup + touch
+            with settings.instantiated_sessionmaker() as session:
+                session.scalars(sa.select(database.CacheEntry)).all()
+        finally:
+            sa.event.remove(settings.engine, "before_cursor_execute", log_begin)
+    assert statements == [
+        "BEGIN DEFERRED",
+        "BEGIN IMMEDIATE",
+        "BEGIN DEFERRED",
+        "BEGIN IMMEDIATE",
+        "BEGIN DEFERRED",
+    ]
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import dataclasses
 import datetime
+import gc
 import pickle
 from typing import Any
 
@@ -153,3 +155,46 @@ def test_dumps_json_serializable() -> None:
     expected = "1"
     actual = encode.dumps(1)
     assert expected == actual
+
+
+@dataclasses.dataclass(frozen=True)
+class FrozenConfig:
+    value: Any
+
+
+class TokenConfig:
+    def __init__(self, value: Any) -> None:
+        self.value = value
+        self.n_calls = 0
+
+    def __cacholote_token__(self) -> str:
+        self.n_calls += 1
+        return str(self.value)
+
+
+def test_hash_immutable_objects() -> None:
+    frozen = FrozenConfig((1, 2))
+    expected = encode._hexdigestify_python_call(func, frozen, 1)
+    assert id(frozen) in encode._HASH_MEMO
+    assert encode._hexdigestify_python_call(func, frozen, 1) == expected
+    assert encode._hexdigestify_python_call(func, FrozenConfig((1, 2)), 1) == expected
+    assert encode._hexdigestify_python_call(func, FrozenConfig((1, 3)), 1) != expected
+
+    # Mutable fields: NOT memoized
+    mutable = FrozenConfig([1, 2])
+    expected = encode._hexdigestify_python_call(func, mutable, 1)
+    assert id(mutable) not in encode._HASH_MEMO
+    mutable.value.append(3)
+    assert encode._hexdigestify_python_call(func, mutable, 1) != expected
+
+    token = TokenConfig("foo")
+    expected = encode._hexdigestify_python_call(func, token, 1)
+    assert encode._hexdigestify_python_call(func, token, 1) == expected
+    assert token.n_calls == 1
+    assert encode._hexdigestify_python_call(func, TokenConfig("foo"), 1) == expected
+    assert encode._hexdigestify_python_call(func, TokenConfig("bar"), 1) != expected
+
+    key = id(token)
+    del token
+    gc.collect()
+    assert key not in encode._HASH_MEMO
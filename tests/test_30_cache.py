@@ -1,12 +1,15 @@
 from __future__ import annotations
 
 import datetime
+import pathlib
+import sqlite3
 import time
 from typing import Any
 
 import pytest
+import sqlalchemy as sa
 
-from cacholote import cache, config, database
+from cacholote import cache, clean, config, database
 
 
 def func(a: Any, *args: Any, b: Any = None, **kwargs: Any) -> Any:
@@ -241,3 +244,99 @@ def test_cache_entry_repr() -> None:
         "tag=None"
         ")"
     )
+
+
+def test_hit_does_not_load_orm_objects() -> None:
+    loaded = []
+
+    def on_load(target: database.CacheEntry, context: Any) -> None:
+        loaded.append(target)
+
+    sa.event.listen(database.CacheEntry, "load", on_load)
+    try:
+        first = cached_now()
+        with config.set(tag="foo"):
+            assert cached_now() == first
+    finally:
+        sa.event.remove(database.CacheEntry, "load", on_load)
+    assert loaded == []
+
+    con = config.get().engine.raw_connection()
+    cur = con.cursor()
+    cur.execute("SELECT tag, counter FROM cache_entries", ())
+    assert cur.fetchall() == [("foo", 2)]
+
+
+def test_cache_db_urlpath_readonly(tmp_path: pathlib.Path) -> None:
+    replica_path = tmp_path / "replica.db"
+    database.init_database(f"sqlite:///{replica_path}")
+    with config.set(cache_db_urlpath_readonly=f"sqlite:///{replica_path}") as settings:
+        # Replica misses fall back to the primary
+        first = cached_now()
+        assert cached_now() == first
+
+        # Replicate
+        assert settings.engine.url.database is not None
+        with sqlite3.connect(settings.engine.url.database) as primary:
+            with sqlite3.connect(replica_path) as replica:
+                primary.backup(replica)
+
+        statements = []
+
+        def before_cursor_execute(
+            conn: Any, cursor: Any, statement: str, *args: Any
+        ) -> None:
+            statements.append(statement)
+
+        sa.event.listen(
+            settings.readonly_engine, "before_cursor_execute", before_cursor_execute
+        )
+        try:
+            assert cached_now() == first
+        finally:
+            sa.event.remove(
+                settings.readonly_engine, "before_cursor_execute", before_cursor_execute
+            )
+        assert len([stmt for stmt in statements if stmt.startswith("SELECT")]) == 1
+
+        # Counters are updated on the primary
+        con = settings.engine.raw_connection()
+        cur = con.cursor()
+        cur.execute("SELECT counter FROM cache_entries", ())
+        assert cur.fetchall() == [(3,)]
+
+        # Stale replica
+        cur.execute("DELETE FROM cache_entries", ())
+        con.commit()
+        assert cached_now() != first
+
+        # Older inserts are NOT looked up on the primary
+        @cache.cacheable
+        def cached_now_again() -> datetime.datetime:
+            return datetime.datetime.now()
+
+        with config.set(cache_db_replica_lag=0):
+            second = cached_now_again()
+            assert cached_now_again() != second
+
+
+def test_sharded_cache_db(tmp_path: pathlib.Path) -> None:
+    shards = [f"sqlite:///{tmp_path / f'shard{i}.db'}" for i in range(3)]
+    cached_str = cache.cacheable(str)
+    with config.set(cache_db_urlpath=shards) as settings:
+        for _ in range(2):
+            assert [cached_str(i) for i in range(10)] == [str(i) for i in range(10)]
+        clean.delete(str, 0)
+
+        keys = []
+        for i, sessionmaker in enumerate(settings.instantiated_sessionmakers):
+            with sessionmaker() as session:
+                for cache_entry in session.scalars(sa.select(database.CacheEntry)):
+                    assert cache_entry.key is not None
+                    assert int(cache_entry.key[:8], 16) % len(shards) == i
+                    assert cache_entry.counter == 2
+                    keys.append(cache_entry.key)
+        assert len(set(keys)) == len(keys) == 9
+
+        with pytest.raises(ValueError, match="sharded"):
+            settings.instantiated_sessionmaker
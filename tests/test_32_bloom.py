@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import datetime
+import pathlib
+from typing import Any
+
+import sqlalchemy as sa
+
+from cacholote import bloom, cache, config, encode, utils
+
+
+def wait_for_build() -> None:
+    if bloom._BUILD_THREAD is not None:
+        bloom._BUILD_THREAD.join()
+
+
+@cache.cacheable
+def cached_now(*args: Any, **kwargs: Any) -> datetime.datetime:
+    return datetime.datetime.now()
+
+
+def test_bloom_filter(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "bloom.bin"
+    bloom_filter = bloom.BloomFilter(path)
+    assert bloom_filter.built_at is None
+    assert bloom_filter.is_stale(3600)
+    assert "foo" in bloom_filter  # unknown
+
+    keys = [utils.hexdigestify(str(i)) for i in range(1000)]
+    bloom_filter.build(
+        lambda created_after: keys[:500] if created_after else keys[500:]
+    )
+    assert not bloom_filter.is_stale(3600)
+    assert all(key in bloom_filter for key in keys)
+    new_keys = [utils.hexdigestify(str(i)) for i in range(1000, 2000)]
+    assert sum(key in bloom_filter for key in new_keys) < 50
+
+    # Other processes see updates and rebuilds
+    other_filter = bloom.BloomFilter(path)
+    bloom_filter.add(*new_keys)
+    assert all(key in other_filter for key in new_keys)
+    bloom_filter.build(lambda created_after: [])
+    assert sum(key in other_filter for key in keys + new_keys) < 100
+
+    # Refreshes add keys created since the last build or refresh
+    synced_at = bloom_filter.synced_at
+    assert synced_at is not None
+    assert not bloom_filter.is_refresh_due(3600)
+    assert bloom_filter.is_refresh_due(0)
+    since = []
+
+    def get_keys(created_after: datetime.datetime | None) -> list[str]:
+        since.append(created_after)
+        return keys
+
+    bloom_filter.refresh(get_keys)
+    assert all(key in other_filter for key in keys)
+    assert since == [
+        datetime.datetime.fromtimestamp(synced_at, tz=datetime.timezone.utc)
+        - bloom._REBUILD_OVERLAP
+    ]
+    assert other_filter.synced_at is not None
+    assert other_filter.synced_at > synced_at
+
+
+def test_bloom_filter_skips_misses(tmp_path: pathlib.Path) -> None:
+    path = str(tmp_path / "bloom.bin")
+    first = cached_now("foo")
+    with config.set(bloom_filter_path=path) as settings:
+        # Filter built in background from the database
+        assert cached_now("foo") == first
+        wait_for_build()
+        assert bloom._get_bloom_filter(path).built_at is not None
+
+        statements = []
+
+        def before_cursor_execute(
+            conn: Any, cursor: Any, statement: str, *args: Any
+        ) -> None:
+            statements.append(statement)
+
+        sa.event.listen(settings.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            second = cached_now("bar")
+            assert cached_now("bar") == second
+        finally:
+            sa.event.remove(
+                settings.engine, "before_cursor_execute", before_cursor_execute
+            )
+        # Miss: INSERT only, Hit: SELECT + UPDATE
+        selects = [stmt for stmt in statements if stmt.startswith("SELECT")]
+        assert len(selects) == 1
+        assert "result" in selects[0]
+        assert len([stmt for stmt in statements if stmt.startswith("INSERT")]) == 1
+
+        # Keys added by other nodes are missed until the next refresh
+        with config.set(bloom_filter_path=None):
+            third = cached_now("baz")
+        key = encode._hexdigestify_python_call(cached_now.__wrapped__, "baz")  # type: ignore[attr-defined]
+        assert bloom.is_definite_miss(settings, key)
+        with config.set(bloom_filter_refresh_interval=0) as refresh_settings:
+            bloom.get_bloom_filter(refresh_settings)
+            wait_for_build()
+        assert not bloom.is_definite_miss(settings, key)
+        assert cached_now("baz") == third
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import datetime
+import pathlib
+import time
+from typing import Any
+
+import pytest
+import sqlalchemy as sa
+
+from cacholote import cache, clean, config, database, hot_cache, utils
+
+TOMORROW = datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(days=1)
+
+
+@cache.cacheable
+def cached_now(*args: Any, **kwargs: Any) -> datetime.datetime:
+    return datetime.datetime.now()
+
+
+def test_hot_cache(tmp_path: pathlib.Path) -> None:
+    hot = hot_cache.HotCache(tmp_path / "hot.bin", size=1024, max_item_size=100)
+    key = utils.hexdigestify("foo")
+    assert hot.get(key) is None
+    assert hot.put(key, 1, TOMORROW, "foo") == []
+    assert hot.get(key) == hot.get(key, expiration=TOMORROW) == "foo"
+    assert hot.get(key, expiration=TOMORROW + datetime.timedelta(1)) is None
+
+    # Other processes share results and hits
+    other = hot_cache.HotCache(tmp_path / "hot.bin")
+    assert other.get(key) == "foo"
+    assert hot.put(key, 1, TOMORROW, "bar") == [(key, 1, 3)]
+    assert other.get(key) == "bar"
+
+    # Large results are NOT stored
+    assert hot.put(key, 1, TOMORROW, "x" * 101) == []
+    assert hot.get(key) == "bar"
+
+    # Evict the least hit results
+    for i in range(100):
+        hot.put(utils.hexdigestify(str(i)), i, TOMORROW, str(i))
+    assert hot.get(key) is None
+
+    hot.put(key, 1, TOMORROW, "foo")
+    hot.discard(key)
+    assert hot.get(key) is None
+
+
+def test_hot_cache_ttl(tmp_path: pathlib.Path) -> None:
+    hot = hot_cache.HotCache(tmp_path / "hot.bin", ttl=0.1)
+    key = utils.hexdigestify("foo")
+    hot.put(key, 1, TOMORROW, "foo")
+    assert hot.get(key) == "foo"
+    time.sleep(0.1)
+    assert hot.get(key) is None
+
+
+def test_cacheable_hot_cache(tmp_path: pathlib.Path) -> None:
+    with config.set(hot_cache_path=str(tmp_path / "hot.bin")) as settings:
+        first = cached_now()
+        assert cached_now() == first  # from the database
+
+        statements = []
+
+        def before_cursor_execute(
+            conn: Any, cursor: Any, statement: str, *args: Any
+        ) -> None:
+            statements.append(statement)
+
+        sa.event.listen(settings.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            for _ in range(3):
+                assert cached_now() == first
+        finally:
+            sa.event.remove(
+                settings.engine, "before_cursor_execute", before_cursor_execute
+            )
+        assert statements == []
+
+        # Hits are flushed on revalidation
+        with config.set(hot_cache_ttl=0):
+            assert cached_now() == first
+        with settings.instantiated_sessionmaker() as session:
+            (cache_entry,) = session.scalars(sa.select(database.CacheEntry))
+        assert cache_entry.counter == 6
+
+        # Entries updated by hits are NOT served from the hot cache
+        with config.set(tag="foo"):
+            assert cached_now() == first
+        with settings.instantiated_sessionmaker() as session:
+            (cache_entry,) = session.scalars(sa.select(database.CacheEntry))
+        assert cache_entry.tag == "foo"
+
+        clean.delete(cached_now)
+        assert cached_now() != first
+
+
+def test_hot_cache_pop_hits(tmp_path: pathlib.Path) -> None:
+    hot = hot_cache.HotCache(tmp_path / "hot.bin", ttl=0.1)
+    foo, bar = utils.hexdigestify("foo"), utils.hexdigestify("bar")
+    hot.put(foo, 1, TOMORROW, "foo")
+    hot.put(bar, 2, TOMORROW, "bar")
+    hot.get(foo)
+    hot.get(foo)
+    assert not hot.is_flush_due()
+    assert hot.pop_hits() == []
+
+    time.sleep(0.1)
+    assert hot.is_flush_due()
+    assert hot.pop_hits() == [(foo, 1, 2)]
+    assert not hot.is_flush_due()
+    assert hot.put(foo, 1, TOMORROW, "foo") == []
+
+
+def test_cacheable_hot_cache_flush_hits(tmp_path: pathlib.Path) -> None:
+    with config.set(hot_cache_path=str(tmp_path / "hot.bin"), hot_cache_ttl=0.5):
+        first = cached_now()  # create the hot cache file
+        time.sleep(0.5)
+        assert cached_now() == first  # from the database
+        with config.get().instantiated_sessionmaker() as session:
+            (cache_entry,) = session.scalars(sa.select(database.CacheEntry))
+        updated_at = cache_entry.updated_at
+        assert updated_at is not None
+
+        # Flushed in background: the flush is due since the file was created
+        assert cached_now() == first
+        assert hot_cache._FLUSH_THREAD is not None
+        hot_cache._FLUSH_THREAD.join()
+        with config.get().instantiated_sessionmaker() as session:
+            (cache_entry,) = session.scalars(sa.select(database.CacheEntry))
+        assert cache_entry.counter == 3
+        assert cache_entry.updated_at is not None
+        assert cache_entry.updated_at > updated_at
+
+
+@pytest.mark.parametrize("delete", [True, False])
+def test_hot_cache_invalidation(tmp_path: pathlib.Path, delete: bool) -> None:
+    with config.set(hot_cache_path=str(tmp_path / "hot.bin")):
+        first = cached_now()
+        assert cached_now() == first  # stored in the hot cache
+
+        clean.expire_cache_entries(delete=delete)
+        assert cached_now() != first
+
+        second = cached_now()
+        assert cached_now() == second  # stored in the hot cache
+        clean.clean_invalid_cache_entries(check_expiration=False, try_decode=True)
+        assert cached_now() == second
+        with config.get().instantiated_sessionmaker() as session:
+            session.execute(
+                sa.update(database.CacheEntry).values(
+                    result={"type": "python_call", "callable": "cacholote:invalid"}
+                )
+            )
+            session.commit()
+        clean.clean_invalid_cache_entries(check_expiration=False, try_decode=True)
+        assert cached_now() != second
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import contextlib
+import datetime
+import time
+from typing import Any
+
+import pytest
+import pytest_structlog
+import sqlalchemy as sa
+import structlog
+
+from cacholote import breaker, cache, config
+
+
+@cache.cacheable
+def cached_now(*args: Any, **kwargs: Any) -> datetime.datetime:
+    return datetime.datetime.now()
+
+
+def test_circuit_breaker() -> None:
+    circuit_breaker = breaker.CircuitBreaker(threshold=2, cooldown=0.1)
+    circuit_breaker.record_failure()
+    assert circuit_breaker.allow()
+    circuit_breaker.record_failure()
+    assert not circuit_breaker.allow()
+
+    # Single trial after the cooldown
+    time.sleep(0.1)
+    assert circuit_breaker.allow()
+    assert not circuit_breaker.allow()
+    circuit_breaker.record_failure()
+    assert not circuit_breaker.allow()
+
+    time.sleep(0.1)
+    assert circuit_breaker.allow()
+    circuit_breaker.record_success()
+    assert circuit_breaker.allow()
+    assert not circuit_breaker.is_open
+
+
+def test_run_with_timeout() -> None:
+    assert breaker.run_with_timeout(lambda x: x, 1, "foo") == "foo"
+    with pytest.raises(TimeoutError, match="exceeded"):
+        breaker.run_with_timeout(time.sleep, 0, 0.1)
+
+
+def test_run_with_timeout_in_flight(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(breaker, "_MAX_WORKERS", 1)
+    monkeypatch.setattr(breaker, "_EXECUTOR", None)
+    monkeypatch.setattr(breaker, "_IN_FLIGHT", None)
+
+    with pytest.raises(TimeoutError, match="exceeded"):
+        breaker.run_with_timeout(time.sleep, 0, 0.2)
+    # Calls are NOT queued behind calls exceeding the timeout
+    with pytest.raises(TimeoutError, match="calls exceeding the timeout"):
+        breaker.run_with_timeout(lambda x: x, 1, "foo")
+    time.sleep(0.3)
+    assert breaker.run_with_timeout(lambda x: x, 1, "foo") == "foo"
+
+
+@pytest.mark.parametrize("set_cache", ["file", "cads"], indirect=True)
+def test_run_with_timeout_cancels_statements(set_cache: str) -> None:
+    settings = config.get()
+    engine = settings.engine
+    errors: list[Exception] = []
+
+    def slow_statement() -> None:
+        try:
+            with engine.connect() as conn:
+                if set_cache == "cads":
+                    conn.exec_driver_sql("SELECT pg_sleep(10)")
+                else:
+                    # Wait on the lock of another connection
+                    conn.execution_options(sqlite_begin="IMMEDIATE")
+                    conn.exec_driver_sql("SELECT 1")
+        except Exception as ex:
+            errors.append(ex)
+
+    with engine.connect() as locking_conn:
+        if set_cache == "file":
+            locking_conn.execution_options(sqlite_begin="IMMEDIATE")
+            locking_conn.exec_driver_sql("SELECT 1")
+        tic = time.perf_counter()
+        with contextlib.suppress(TimeoutError):
+            # Statements might be cancelled before the timeout of the caller
+            breaker.run_with_timeout(slow_statement, 0.2)
+        while not errors and time.perf_counter() - tic < 5:
+            time.sleep(0.01)
+    (error,) = errors
+    assert isinstance(error, sa.exc.OperationalError)
+    assert time.perf_counter() - tic < 5
+
+    # Statements outside the budget are NOT affected
+    with engine.connect() as conn:
+        if set_cache == "file":
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 30_000
+        else:
+            assert conn.exec_driver_sql("SHOW statement_timeout").scalar() == "0"
+
+
+def test_lookup_timeout(log: pytest_structlog.StructuredLogCapture) -> None:
+    with config.set(
+        lookup_timeout=0.5,
+        circuit_breaker_threshold=2,
+        circuit_breaker_cooldown=60,
+        logger=structlog.get_logger(),
+    ) as settings:
+        # Initialize the database (migrations are slow)
+        settings.engine
+        first = cached_now()
+        assert cached_now() == first
+
+        statements = []
+
+        def slow_cursor_execute(
+            conn: Any, cursor: Any, statement: str, *args: Any
+        ) -> None:
+            statements.append(statement)
+            time.sleep(1)
+
+        sa.event.listen(settings.engine, "before_cursor_execute", slow_cursor_execute)
+        try:
+            # Last known good result
+            assert cached_now() == first
+            # Function is called
+            assert cached_now("foo") != cached_now("foo")
+            # Circuit is open
+            n_statements = len(statements)
+            assert cached_now() == first
+            assert len(statements) == n_statements
+            with config.set(return_cache_entry=True):
+                with pytest.raises(breaker.CircuitOpenError):
+                    cached_now()
+        finally:
+            sa.event.remove(
+                settings.engine, "before_cursor_execute", slow_cursor_execute
+            )
+        # Wait for lookups running in background
+        time.sleep(1.5)
+
+    assert log.events[0] == {
+        "event": "bypassing cache",
+        "level": "warning",
+        "reason": "'_get_cache_entry_result' exceeded timeout=0.5s",
+    }
+    assert log.events[-1] == {
+        "event": "bypassing cache",
+        "level": "warning",
+        "reason": "the cache database keeps exceeding `lookup_timeout`",
+    }
+
+
+def test_failing_backend(log: pytest_structlog.StructuredLogCapture) -> None:
+    with config.set(
+        lookup_timeout=10,
+        circuit_breaker_threshold=2,
+        circuit_breaker_cooldown=60,
+        logger=structlog.get_logger(),
+    ) as settings:
+        first = cached_now()
+        assert cached_now() == first
+
+        def failing_cursor_execute(
+            conn: Any, cursor: Any, statement: str, *args: Any
+        ) -> None:
+            if statement.startswith("INSERT") or failing_statements == "all":
+                raise RuntimeError("the database is down")
+
+        failing_statements = "insert"
+        sa.event.listen(
+            settings.engine, "before_cursor_execute", failing_cursor_execute
+        )
+        try:
+            # Results are returned without being cached
+            assert cached_now("foo") != cached_now("foo")
+            assert not breaker.get_circuit_breaker(settings).is_open
+
+            # Last known good result
+            failing_statements = "all"
+            assert cached_now() == first
+            assert breaker.get_circuit_breaker(settings).is_open
+            # Function is called
+            assert cached_now("bar") != cached_now("bar")
+        finally:
+            sa.event.remove(
+                settings.engine, "before_cursor_execute", failing_cursor_execute
+            )
+
+    assert {
+        "event": "bypassing cache",
+        "level": "warning",
+        "reason": "the database is down",
+    } in log.events
+
+    with config.set(lookup_timeout=None) as settings:
+        sa.event.listen(
+            settings.engine, "before_cursor_execute", failing_cursor_execute
+        )
+        try:
+            with pytest.raises(RuntimeError, match="the database is down"):
+                cached_now()
+        finally:
+            sa.event.remove(
+                settings.engine, "before_cursor_execute", failing_cursor_execute
+            )
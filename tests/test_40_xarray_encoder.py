@@ -8,7 +8,7 @@ import pytest
 import pytest_structlog
 import structlog
 
-from cacholote import cache, config, decode, encode, extra_encoders, utils
+from cacholote import cache, clean, config, decode, encode, extra_encoders, utils
 
 if TYPE_CHECKING:
     import xarray as xr
@@ -54,7 +54,9 @@ def test_dictify_xr_dataset(tmp_path: pathlib.Path) -> None:
             {
                 "type": "application/netcdf",
                 "href": href,
-                "file:checksum": f"{fsspec.filesystem('file').checksum(local_path):x}",
+                "file:checksum": extra_encoders._get_checksum(
+                    fsspec.filesystem("file"), local_path
+                ),
                 "file:size": 669,
                 "file:local_path": local_path,
             },
@@ -196,6 +198,7 @@ def test_xr_logging(log: pytest_structlog.StructuredLogCapture) -> None:
             "urlpath": urlpath,
             "size": 22597,
             "upload_time": log.events[3]["upload_time"],
+            "upload_throughput": log.events[3]["upload_throughput"],
             "event": "end upload",
             "level": "info",
         },
@@ -226,3 +229,123 @@ def test_xr_roundtrip(original_obj: xr.Dataset | xr.DataArray) -> None:
     xr.testing.assert_identical(cached_obj, original_obj)
     assert original_obj.encoding.get("source") is None
     assert cached_obj.encoding.get("source") is not None
+
+
+def test_xr_argument_fingerprint() -> None:
+    @cache.cacheable
+    def mean(obj: xr.Dataset) -> float:
+        return float(obj["foo"].mean())
+
+    ds = xr.Dataset({"foo": ("x", [0, 1])})
+    fs, dirname = utils.get_cache_files_fs_dirname()
+    assert mean(ds) == mean(ds) == 0.5
+    assert not fs.exists(dirname) or not fs.ls(dirname)
+
+    con = config.get().engine.raw_connection()
+    cur = con.cursor()
+    cur.execute("SELECT counter FROM cache_entries", ())
+    assert cur.fetchall() == [(2,)]
+
+    assert mean(ds + 1) == 1.5
+
+
+@pytest.mark.parametrize(
+    "xarray_fingerprint", ["content", "sampled", "metadata", "key"]
+)
+def test_xr_fingerprint(tmp_path: pathlib.Path, xarray_fingerprint: str) -> None:
+    pytest.importorskip("netCDF4")
+    config.set(xarray_fingerprint=xarray_fingerprint)
+
+    @cache.cacheable
+    def cached_dataset(value: int) -> xr.Dataset:
+        return xr.Dataset({"foo": ("x", [value] * 10)})
+
+    fs, dirname = utils.get_cache_files_fs_dirname()
+    first = cached_dataset(0)
+    second = cached_dataset(1)
+    xr.testing.assert_identical(first, xr.Dataset({"foo": ("x", [0] * 10)}))
+
+    # Same metadata, different values
+    first_path = first.encoding["source"]
+    second_path = second.encoding["source"]
+    assert first_path != second_path
+    xr.testing.assert_identical(second, xr.Dataset({"foo": ("x", [1] * 10)}))
+
+    if xarray_fingerprint == "metadata":
+        path = str(tmp_path / "test.nc")
+        xr.Dataset({"foo": ("x", list(range(10)))}).to_netcdf(path)
+
+        @cache.cacheable
+        def cached_subset(path: str, start: int) -> xr.Dataset:
+            return xr.open_dataset(path).isel(x=slice(start, start + 5))
+
+        # Objects opened from files are NOT hashed, but selections are
+        with xr.open_dataset(path) as opened:
+            token = extra_encoders._tokenize_xr_object(opened, "metadata")
+            assert token == extra_encoders._tokenize_xr_object(opened, "metadata")
+            assert token != extra_encoders._tokenize_xr_object(opened, "content")
+            # Values in memory
+            modified = opened + 1
+            assert extra_encoders._tokenize_xr_object(
+                modified, "metadata"
+            ) == extra_encoders._tokenize_xr_object(modified, "content")
+        assert cached_subset(path, 0).foo.values.tolist() == [0, 1, 2, 3, 4]
+        assert cached_subset(path, 5).foo.values.tolist() == [5, 6, 7, 8, 9]
+
+    if xarray_fingerprint == "key":
+        hexdigest = encode._hexdigestify_python_call(cached_dataset.__wrapped__, 0)  # type: ignore[attr-defined]
+        assert first_path.rsplit("/", 1)[1].startswith(f"{hexdigest}-")
+    else:
+        # Without a cache key, fall back to content
+        expected = extra_encoders._tokenize_xr_object(first, "content")
+        with config.set(xarray_fingerprint="key"):
+            assert extra_encoders._tokenize_xr_object(first, "key") == expected
+
+
+@pytest.mark.parametrize("set_cache", ["cads"], indirect=True)
+def test_xr_reference_index(set_cache: str) -> None:
+    pytest.importorskip("netCDF4")
+    pytest.importorskip("kerchunk")
+    config.set(xarray_reference_index=True)
+
+    @cache.cacheable
+    def cached_dataset() -> xr.Dataset:
+        return xr.Dataset({"foo": ("x", list(range(10)))})
+
+    expected = cached_dataset.__wrapped__()  # type: ignore[attr-defined]
+    cached_dataset()
+    fs, dirname = utils.get_cache_files_fs_dirname()
+    (refs_path,) = fs.glob(f"{dirname}/*.refs.json")
+
+    with config.set(return_cache_entry=True):
+        cache_entry = cached_dataset()
+    file_json = cache_entry.result["args"][0]
+    assert file_json["file:references"]["file:local_path"].endswith(".refs.json")
+
+    # Opened lazily with range requests
+    xr.testing.assert_identical(cached_dataset(), expected)
+
+    # Indexes are deleted with cache files
+    clean.clean_cache_files(maxsize=0)
+    assert not fs.exists(refs_path)
+
+
+def test_stream_file_object() -> None:
+    fs = fsspec.filesystem("memory")
+
+    def write(path: str, fail: bool = False) -> None:
+        with open(path, "wb") as f:
+            for _ in range(1_000):
+                f.write(b"foo" * 1_000)
+            if fail:
+                raise ValueError("foo")
+
+    extra_encoders._stream_file_object(write, fs, "/stream/foo.grib")
+    assert fs.cat_file("/stream/foo.grib") == b"foo" * 1_000_000
+
+    # Partial files are removed
+    with pytest.raises(ValueError, match="foo"):
+        extra_encoders._stream_file_object(
+            lambda path: write(path, fail=True), fs, "/stream/bar.grib"
+        )
+    assert not fs.exists("/stream/bar.grib")
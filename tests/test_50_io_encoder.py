@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import contextlib
+import gzip
 import hashlib
 import importlib
 import io
+import os
 import pathlib
 import subprocess
 from typing import Any
@@ -49,7 +51,9 @@ def test_dictify_io_object(tmp_path: pathlib.Path, io_delete_original: bool) ->
             {
                 "type": "text/plain",
                 "href": href,
-                "file:checksum": f"{fsspec.filesystem('file').checksum(local_path):x}",
+                "file:checksum": extra_encoders._get_checksum(
+                    fsspec.filesystem("file"), local_path
+                ),
                 "file:size": 4,
                 "file:local_path": local_path,
             },
@@ -70,7 +74,7 @@ def test_dictify_bytes_io_object(
     tmp_path: pathlib.Path, obj: io.BytesIO | io.StringIO
 ) -> None:
     actual = extra_encoders.dictify_io_object(obj)["args"]
-    obj_hash = hashlib.md5(f"{hash(obj)}".encode()).hexdigest()
+    obj_hash = hashlib.md5(b"test").hexdigest()
     local_path = f"{tmp_path}/cache_files/{obj_hash}"
     type = (
         "text/plain"
@@ -81,7 +85,9 @@ def test_dictify_bytes_io_object(
         {
             "type": type,
             "href": local_path,
-            "file:checksum": f"{fsspec.filesystem('file').checksum(local_path):x}",
+            "file:checksum": extra_encoders._get_checksum(
+                fsspec.filesystem("file"), local_path
+            ),
             "file:size": 4,
             "file:local_path": local_path,
         },
@@ -90,6 +96,10 @@ def test_dictify_bytes_io_object(
     assert actual == expected
     assert open(local_path).read() == "test"
 
+    # Content addressed
+    actual = extra_encoders.dictify_io_object(io.BytesIO(b"test"))["args"]
+    assert actual[0]["file:local_path"] == local_path
+
 
 @pytest.mark.parametrize("set_cache", ["file", "cads"], indirect=True)
 def test_copy_from_http_to_cache(
@@ -164,6 +174,8 @@ def test_io_locker(
     raises_or_warns: contextlib.nullcontext,  # type: ignore[type-arg]
 ) -> None:
     config.set(lock_timeout=lock_timeout, raise_all_encoding_errors=True)
+    # Initialize the database (migrations are slow) before the lock is released
+    config.get().engine
     # Create tmpfile
     tmpfile = tmp_path / "test.txt"
     fsspec.filesystem("file").touch(tmpfile)
@@ -238,6 +250,189 @@ def test_io_logging(
     assert log.events == expected
 
 
+@pytest.mark.parametrize("set_cache", ["cads"], indirect=True)
+def test_io_local_copies(tmp_path: pathlib.Path) -> None:
+    local_dir = tmp_path / "local"
+    config.set(cache_files_local_dir=str(local_dir), cache_files_local_maxsize=3)
+    fs, dirname = utils.get_cache_files_fs_dirname()
+
+    tmpfiles = []
+    for i, content in enumerate([b"1", b"22", b"33", b"4444"]):
+        tmpfiles.append(tmp_path / f"test{i}.txt")
+        tmpfiles[-1].write_bytes(content)
+
+    # Copies are named after checksums
+    cached_file = cached_open(tmpfiles[0])
+    (urlpath,) = fs.ls(dirname)
+    checksum = f"{fs.checksum(urlpath):x}"
+    assert cached_file.read() == b"1"
+    assert isinstance(cached_file, fsspec.implementations.local.LocalFileOpener)
+    assert cached_file.path == str(local_dir / f"{checksum}.txt")
+    assert cached_open(tmpfiles[0]).path == cached_file.path
+
+    # Least recently used copies are evicted
+    assert cached_open(tmpfiles[1]).read() == b"22"
+    assert cached_open(tmpfiles[0]).read() == b"1"
+    assert len(list(local_dir.glob("*.txt"))) == 2
+    assert cached_open(tmpfiles[2]).read() == b"33"
+    assert sorted(path.name for path in local_dir.glob("*.txt")) == sorted(
+        pathlib.Path(cached_open(tmpfile).path).name for tmpfile in tmpfiles[::2]
+    )
+
+    # Large files are NOT copied
+    cached_file = cached_open(tmpfiles[3])
+    assert cached_file.read() == b"4444"
+    assert "s3" in cached_file.fs.protocol
+
+
+@pytest.mark.parametrize("set_cache", ["cads"], indirect=True)
+def test_io_transfers(monkeypatch: pytest.MonkeyPatch) -> None:
+    config.set(transfer_part_size=5 * 2**20, transfer_concurrency=2)
+    fs_out, dirname = utils.get_cache_files_fs_dirname()
+    contents = os.urandom(12 * 2**20)
+
+    # Parts downloaded concurrently
+    fs_in = fsspec.filesystem("memory")
+    fs_in.pipe_file("/transfers/foo.bin", contents)
+    extra_encoders._store_file_object(
+        fs_in, "/transfers/foo.bin", fs_out, f"{dirname}/foo.bin"
+    )
+    assert fs_out.cat_file(f"{dirname}/foo.bin") == contents
+
+    # Server-side copy within the same filesystem
+    fs_in = fsspec.filesystem(
+        "s3", **config.get().cache_files_storage_options, skip_instance_cache=True
+    )
+    assert fs_in is not fs_out
+    monkeypatch.setattr(fs_in, "cat_file", None)
+    extra_encoders._store_file_object(
+        fs_in, f"{dirname}/foo.bin", fs_out, f"{dirname}/bar.bin"
+    )
+    assert fs_out.cat_file(f"{dirname}/bar.bin") == contents
+
+    # Different storage options (e.g., endpoints or accounts): NOT server-side
+    fs_out.pipe_file(f"{dirname}/baz.bin", contents)
+    fs_in = fsspec.filesystem(
+        "s3", **config.get().cache_files_storage_options, default_block_size=2**20
+    )
+    monkeypatch.setattr(fs_in, "cp_file", None)
+    extra_encoders._store_file_object(
+        fs_in, f"{dirname}/baz.bin", fs_out, f"{dirname}/qux.bin"
+    )
+    assert fs_out.cat_file(f"{dirname}/qux.bin") == contents
+
+
+@pytest.mark.parametrize("io_copy_strategy", ["auto", "copy"])
+def test_io_copy_strategy(tmp_path: pathlib.Path, io_copy_strategy: str) -> None:
+    config.set(io_copy_strategy=io_copy_strategy)
+    tmpfile = tmp_path / "test.txt"
+    tmpfile.write_text("test")
+
+    cached_file = cached_open(tmpfile)
+    is_shared = os.stat(cached_file.path).st_ino == os.stat(tmpfile).st_ino
+    assert is_shared is (io_copy_strategy == "auto")
+
+    # Removing hard links does not invalidate cache files
+    tmpfile.unlink()
+    assert cached_open(tmpfile).read() == b"test"
+
+
+def test_io_mmap(tmp_path: pathlib.Path) -> None:
+    np = pytest.importorskip("numpy")
+    config.set(io_mmap=True)
+    tmpfile = tmp_path / "test.bin"
+    tmpfile.write_bytes(np.arange(10, dtype="int32").tobytes() + b"\nfoo")
+
+    cached_open(tmpfile)
+    f = cached_open(tmpfile)
+    assert isinstance(f, extra_encoders.MappedFile)
+    assert f.read(4) == np.int32(0).tobytes()
+    f.seek(-4, io.SEEK_END)
+    assert f.readline() == b"\n"
+    assert f.read() == b"foo"
+
+    # Zero-copy views
+    array = np.frombuffer(f.getbuffer(), dtype="int32", count=10)
+    np.testing.assert_equal(array, np.arange(10))
+    assert not array.flags.writeable
+    f.close()
+    np.testing.assert_equal(array, np.arange(10))
+
+
+@pytest.mark.parametrize("set_cache", ["file", "cads"], indirect=True)
+def test_io_compression(tmp_path: pathlib.Path) -> None:
+    config.set(cache_files_compression={"text/*": "gzip"}, io_mmap=True)
+    tmpfile = tmp_path / "test.txt"
+    tmpfile.write_text("test" * 100)
+
+    file_json = extra_encoders.dictify_io_object(open(tmpfile, "rb"))["args"][0]
+    assert file_json["type"] == "text/plain"
+    assert file_json["file:compression"] == "gzip"
+    assert file_json["file:local_path"].endswith(".txt.gz")
+    assert file_json["file:size"] < 100
+
+    fs, _ = utils.get_cache_files_fs_dirname()
+    with fs.open(file_json["file:local_path"], "rb") as f:
+        assert gzip.decompress(f.read()) == b"test" * 100
+
+    # Decompressed on the fly (memory maps are NOT used)
+    with cached_open(tmpfile, "rb") as f:
+        assert f.read() == b"test" * 100
+
+    # Other types are NOT compressed
+    tmpfile = tmp_path / "test.bin"
+    tmpfile.write_bytes(b"test" * 100)
+    file_json = extra_encoders.dictify_io_object(open(tmpfile, "rb"))["args"][0]
+    assert "file:compression" not in file_json
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+@pytest.mark.parametrize("io_delete_original", [True, False])
+def test_io_content_addressed(
+    tmp_path: pathlib.Path,
+    monkeypatch: pytest.MonkeyPatch,
+    io_delete_original: bool,
+    compression: str | None,
+) -> None:
+    config.set(
+        io_content_addressed=True,
+        io_delete_original=io_delete_original,
+        cache_files_compression={"text/*": compression} if compression else {},
+    )
+    tmpfile = tmp_path / "test.txt"
+    tmpfile.write_bytes(b"test")
+
+    opened = []
+    local_open = fsspec.implementations.local.LocalFileSystem._open
+
+    def counting_open(self: Any, path: str, mode: str = "rb", **kwargs: Any) -> Any:
+        opened.append((path, mode))
+        return local_open(self, path, mode, **kwargs)
+
+    monkeypatch.setattr(
+        fsspec.implementations.local.LocalFileSystem, "_open", counting_open
+    )
+    file_json = extra_encoders.dictify_io_object(open(tmpfile, "rb"))["args"][0]
+    monkeypatch.undo()
+
+    # Files are read once: the digest is computed while copying
+    assert [mode for _, mode in opened].count("rb") == 1
+    ext = ".txt.gz" if compression else ".txt"
+    root = hashlib.md5(b"test").hexdigest()
+    fs, dirname = utils.get_cache_files_fs_dirname()
+    assert file_json["file:local_path"] == f"{dirname}/{root}{ext}"
+    assert file_json["type"] == "text/plain"
+    assert fs.ls(dirname, detail=False) == [file_json["file:local_path"]]
+    assert tmpfile.exists() is not io_delete_original
+
+    # Identical files are stored once
+    tmpfile = tmp_path / "copy.txt"
+    tmpfile.write_bytes(b"test")
+    other_json = extra_encoders.dictify_io_object(open(tmpfile, "rb"))["args"][0]
+    assert other_json["file:local_path"] == file_json["file:local_path"]
+    assert fs.ls(dirname, detail=False) == [file_json["file:local_path"]]
+
+
 def test_io_in_place_file(tmp_path: pathlib.Path) -> None:
     @cache.cacheable
     def cached_in_place_open(path: str) -> io.FileIO:
@@ -249,3 +444,43 @@ def test_io_in_place_file(tmp_path: pathlib.Path) -> None:
     output = cached_in_place_open(str(tmpfile))
     assert isinstance(output, fsspec.implementations.local.LocalFileOpener)
     assert output.name == str(tmpfile)
+
+
+def test_io_argument_fingerprint(tmp_path: pathlib.Path) -> None:
+    @cache.cacheable
+    def read_file(f: io.BufferedReader) -> bytes:
+        return f.read()
+
+    tmpfile = tmp_path / "test.txt"
+    fsspec.filesystem("file").pipe_file(tmpfile, b"test")
+
+    # Arguments are NOT copied to the cache storage
+    fs, dirname = utils.get_cache_files_fs_dirname()
+    with open(tmpfile, "rb") as f:
+        assert read_file(f) == b"test"
+    with open(tmpfile, "rb") as f:
+        assert read_file(f) == b"test"
+    assert not fs.exists(dirname) or not fs.ls(dirname)
+
+    con = config.get().engine.raw_connection()
+    cur = con.cursor()
+    cur.execute("SELECT counter FROM cache_entries", ())
+    assert cur.fetchall() == [(2,)]
+
+    # Fingerprint changes when the file changes
+    fsspec.filesystem("file").pipe_file(tmpfile, b"new test")
+    with open(tmpfile, "rb") as f:
+        assert read_file(f) == b"new test"
+
+
+@pytest.mark.parametrize("obj", [io.BytesIO(b"test"), io.StringIO("test")])
+def test_fingerprint_bytes_io_object(obj: io.BytesIO | io.StringIO) -> None:
+    obj.seek(1)
+    actual = extra_encoders.fingerprint_io_object(obj)
+    actual.pop("kwargs")
+    assert actual == {
+        "type": "io_fingerprint",
+        "file:checksum": hashlib.md5(b"est").hexdigest(),
+        "file:size": 3,
+    }
+    assert obj.tell() == 1
@@ -11,9 +11,10 @@ import fsspec
 import pydantic
 import pytest
 import pytest_structlog
+import sqlalchemy as sa
 import structlog
 
-from cacholote import cache, clean, config, utils
+from cacholote import cache, clean, config, database, utils
 
 ONE_BYTE = os.urandom(1)
 TODAY = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -520,6 +521,40 @@ def test_expire_cache_entries_dry_run(dry_run: bool, cache_entries: int) -> None
     assert cur.fetchone() == (cache_entries,)
 
 
+@pytest.mark.parametrize("use_database", [True, False])
+def test_clean_sharded_cache_files(tmp_path: pathlib.Path, use_database: bool) -> None:
+    shards = [f"sqlite:///{tmp_path / f'shard{i}.db'}" for i in range(3)]
+    with config.set(cache_db_urlpath=shards):
+        fs, dirname = utils.get_cache_files_fs_dirname()
+
+        cached_paths = []
+        for i in range(6):
+            path = tmp_path / f"{i}.txt"
+            path.write_text(str(i))
+            cached_paths.append(open_url(path).path)
+        # Most recently used
+        open_url(tmp_path / "0.txt")
+
+        # LRU across shards
+        clean.clean_cache_files(3, use_database=use_database)
+        assert set(fs.ls(dirname)) == {cached_paths[0], *cached_paths[4:]}
+        assert clean.expire_cache_entries(dry_run=True) == 3
+
+        clean.clean_invalid_cache_entries(check_expiration=False, try_decode=True)
+        assert clean.expire_cache_entries(delete=True) == 3
+        assert fs.ls(dirname) == []
+
+
+def test_expire_cache_entries_dry_run_readonly(tmp_path: pathlib.Path) -> None:
+    replica = f"sqlite:///{tmp_path / 'replica.db'}"
+    database.init_database(replica)
+
+    cached_now()
+    with config.set(cache_db_urlpath_readonly=replica):
+        assert clean.expire_cache_entries(dry_run=True, before=TOMORROW) == 0
+        assert clean.expire_cache_entries(dry_run=False, before=TOMORROW) == 1
+
+
 @pytest.mark.parametrize(
     "batch_size,batch_delay,expected_time",
     [
@@ -553,3 +588,77 @@ def test_clean_invalid_cache_entries_batch(
 
     cur.execute("SELECT COUNT(*) FROM cache_entries", ())
     assert cur.fetchone() == (0,)
+
+
+@pytest.mark.parametrize("set_cache", ["file", "cads"], indirect=True)
+def test_clean_shared_cache_files(tmp_path: pathlib.Path) -> None:
+    config.set(io_content_addressed=True)
+    fs, dirname = utils.get_cache_files_fs_dirname()
+    tmpfiles = []
+    for name in ("foo", "bar"):
+        tmpfile = tmp_path / f"{name}.txt"
+        tmpfile.write_bytes(b"foo")
+        tmpfiles.append(tmpfile)
+
+    # Identical files are stored once
+    assert len({open_url(tmpfile).path for tmpfile in tmpfiles}) == 1
+    (cache_file,) = fs.ls(dirname)
+    with config.get().instantiated_sessionmaker() as session:
+        (file_refs,) = session.scalars(sa.select(database.CacheFile))
+    assert file_refs.refcount == 2
+
+    # Files are removed with their last reference
+    clean.delete(open_url, tmpfiles[0])
+    assert fs.exists(cache_file)
+    clean.delete(open_url, tmpfiles[1])
+    assert not fs.exists(cache_file)
+    with config.get().instantiated_sessionmaker() as session:
+        assert session.scalars(sa.select(database.CacheFile)).all() == []
+
+
+@pytest.mark.parametrize("set_cache", ["file", "cads"], indirect=True)
+def test_clean_shared_results() -> None:
+    @cache.cacheable
+    def cached_constant(*args: Any) -> dict[str, Any]:
+        return {"foo": [1, 2]}
+
+    config.set(deduplicate_results=True)
+    # Identical results are stored once
+    assert cached_constant("foo") == cached_constant("bar") == {"foo": [1, 2]}
+    with config.set(return_cache_entry=True):
+        cache_entry = cached_constant("foo")
+    assert isinstance(cache_entry, database.CacheEntry)
+    assert cache_entry.result == {"foo": [1, 2]}
+    with config.get().instantiated_sessionmaker() as session:
+        (shared_result,) = session.scalars(sa.select(database.CacheResult))
+        (result,) = set(session.scalars(sa.select(database.CacheEntry.result)))
+    assert shared_result.refcount == 2
+    assert result is None
+
+    # Results are removed with their last reference
+    clean.delete(cached_constant, "foo")
+    assert cached_constant("bar") == {"foo": [1, 2]}
+    clean.delete(cached_constant, "bar")
+    with config.get().instantiated_sessionmaker() as session:
+        assert session.scalars(sa.select(database.CacheResult)).all() == []
+
+
+@pytest.mark.parametrize("set_cache", ["file", "cads"], indirect=True)
+def test_clean_cache_files_nulls_first(tmp_path: pathlib.Path, set_cache: str) -> None:
+    fs, dirname = utils.get_cache_files_fs_dirname()
+    for name in ("null", "used"):
+        fsspec.filesystem("file").pipe_file(tmp_path / f"{name}.txt", ONE_BYTE)
+    null_path = open_url(tmp_path / "null.txt").path
+    used_path = open_url(tmp_path / "used.txt").path
+
+    # Entries with NULL counters are the least frequently used (on all backends)
+    with config.get().instantiated_sessionmaker() as session:
+        session.execute(
+            sa.update(database.CacheEntry)
+            .where(database.CacheEntry.id == 1)
+            .values(counter=None)
+        )
+        session.commit()
+    clean.clean_cache_files(1, method="LFU")
+    assert not fs.exists(null_path)
+    assert fs.exists(used_path)
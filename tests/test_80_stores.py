@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import datetime
+import pathlib
+from typing import Any
+
+import fsspec
+import pytest
+
+from cacholote import cache, clean, config, database, encode, stores, utils
+
+TODAY = datetime.datetime.now(tz=datetime.timezone.utc)
+TOMORROW = TODAY + datetime.timedelta(days=1)
+YESTERDAY = TODAY - datetime.timedelta(days=1)
+
+
+@cache.cacheable
+def cached_now(*args: Any, **kwargs: Any) -> datetime.datetime:
+    return datetime.datetime.now()
+
+
+@cache.cacheable
+def open_url(url: pathlib.Path) -> fsspec.spec.AbstractBufferedFile:
+    with fsspec.open(url) as f:
+        return f
+
+
+@pytest.fixture
+def store(tmp_path: pathlib.Path) -> stores.SQLiteStore:
+    return stores.SQLiteStore(tmp_path / "store.db")
+
+
+def test_default_store() -> None:
+    store = config.get().get_metadata_store("foo")
+    assert isinstance(store, stores.SQLAlchemyStore)
+
+
+def test_sqlite_store(store: stores.SQLiteStore) -> None:
+    with config.set(metadata_store=store, tag="foo"):
+        first = cached_now()
+        assert cached_now() == first
+
+    # Nothing is stored in the database
+    with config.get().instantiated_sessionmaker() as session:
+        assert session.query(database.CacheEntry).count() == 0
+
+    (cache_entry,) = store.iter_entries()
+    assert cache_entry.counter == 2
+    assert cache_entry.tag == "foo"
+    assert cache_entry.expiration == database._DATETIME_MAX.replace(tzinfo=None)
+
+    with config.set(metadata_store=store, return_cache_entry=True, tag="bar"):
+        returned_entry = cached_now()
+    assert isinstance(returned_entry, database.CacheEntry)
+    assert returned_entry.counter == 3
+    assert returned_entry.tag == "bar"
+
+
+def test_sqlite_store_expiration(store: stores.SQLiteStore) -> None:
+    with config.set(metadata_store=store, expiration=TOMORROW):
+        first = cached_now()
+        assert cached_now() == first
+
+    with config.set(metadata_store=store):
+        assert cached_now() == first
+
+    with config.set(metadata_store=store, expiration=TODAY + datetime.timedelta(2)):
+        assert cached_now() != first
+
+    with config.set(metadata_store=store, expiration=YESTERDAY):
+        with pytest.warns(UserWarning, match="Expiration date has passed"):
+            cached_now()
+
+    assert len(list(store.iter_entries())) == 3
+
+
+def test_sqlite_store_delete(store: stores.SQLiteStore) -> None:
+    with config.set(metadata_store=store):
+        cached_now("foo")
+        cached_now("bar")
+        clean.delete(cached_now, "foo")
+    (cache_entry,) = store.iter_entries()
+    assert cache_entry.key == encode._hexdigestify_python_call(cached_now, "bar")
+
+
+def test_sqlite_store_clean_cache_files(
+    tmp_path: pathlib.Path, store: stores.SQLiteStore
+) -> None:
+    fs, dirname = utils.get_cache_files_fs_dirname()
+    for i, tag in enumerate(["foo", None]):
+        (tmp_path / f"{i}.txt").write_bytes(bytes(i + 1))
+        with config.set(metadata_store=store, tag=tag):
+            open_url(tmp_path / f"{i}.txt")
+    cache_entries = list(store.iter_entries())
+    assert len(cache_entries) == 2
+    assert len(fs.ls(dirname)) == 2
+
+    with config.set(metadata_store=store):
+        clean.clean_cache_files(1, tags_to_keep=["foo"])
+    assert [cache_entry.tag for cache_entry in store.iter_entries()] == ["foo"]
+    assert len(fs.ls(dirname)) == 1
+
+    with config.set(metadata_store=store):
+        clean.clean_cache_files(0)
+    assert list(store.iter_entries()) == []
+    assert fs.ls(dirname) == []
+
+
+def test_sqlite_store_clean_invalid_cache_entries(store: stores.SQLiteStore) -> None:
+    with config.set(metadata_store=store, expiration=TOMORROW):
+        cached_now("valid")
+    with config.set(metadata_store=store, expiration=YESTERDAY):
+        with pytest.warns(UserWarning, match="Expiration date has passed"):
+            cached_now("expired")
+
+    with config.set(metadata_store=store):
+        clean.clean_invalid_cache_entries()
+    (cache_entry,) = store.iter_entries()
+    assert cache_entry.expiration is not None
+    assert cache_entry.expiration > TODAY.replace(tzinfo=None)
+
+
+def test_sqlite_store_expire_cache_entries(store: stores.SQLiteStore) -> None:
+    with config.set(metadata_store=store, tag="foo"):
+        cached_now("foo")
+    with config.set(metadata_store=store, tag="bar"):
+        cached_now("bar")
+
+    with config.set(metadata_store=store):
+        assert clean.expire_cache_entries(tags=["foo"], dry_run=True) == 1
+        assert clean.expire_cache_entries(after=YESTERDAY, before=TOMORROW) == 2
+        assert clean.expire_cache_entries(tags=["bar"], delete=True) == 1
+
+    (cache_entry,) = store.iter_entries()
+    assert cache_entry.tag == "foo"
+    assert cache_entry.expiration is not None
+    assert cache_entry.expiration <= utils.utcnow().replace(tzinfo=None)
+
+
+def test_tiered_store(tmp_path: pathlib.Path) -> None:
+    local_path = str(tmp_path / "local.db")
+    with config.set(cache_db_local_path=local_path, cache_db_local_sync_interval=3600):
+        store = config.get().get_metadata_store("foo")
+        assert isinstance(store, stores.TieredStore)
+        assert config.get().get_metadata_store("bar") is store
+
+        # Write through (the first sync runs in background)
+        first = cached_now()
+        assert store._sync_thread is not None
+        store._sync_thread.join()
+        (central_entry,) = store.central.iter_entries()
+        (local_entry,) = store.local.iter_entries()
+        assert central_entry.id is not None and local_entry.id is not None
+        assert central_entry.id == local_entry.id
+        assert central_entry.counter == local_entry.counter == 1
+
+        # Hits are served locally
+        assert cached_now() == first
+        assert store.central.get_entry(central_entry.id).counter == 1  # type: ignore[union-attr]
+        assert store.local.get_entry(local_entry.id).counter == 2  # type: ignore[union-attr]
+
+        # Counters are flushed
+        store.sync()
+        assert store.central.get_entry(central_entry.id).counter == 2  # type: ignore[union-attr]
+        assert store.local._get_pending_touches() == []
+
+        # Updates of used keys are pulled
+        store.central.touch_entry(central_entry.id, tag="foo")
+        store.sync()
+        assert store.local.get_entry(local_entry.id).tag == "foo"  # type: ignore[union-attr]
+
+        # Deletions by other nodes are tombstoned
+        store.central.delete_entries(central_entry.id)
+        assert list(store.local.iter_entries()) != []
+        store.sync()
+        assert list(store.local.iter_entries()) == []
+
+        # Cleaners invalidate the local index
+        cached_now()
+        assert list(store.local.iter_entries()) != []
+        clean.expire_cache_entries(delete=True)
+        assert list(store.central.iter_entries()) == []
+        assert list(store.local.iter_entries()) == []
+
+        # Entries are read through
+        cached_now("bar")
+        store.local._connection.execute("DELETE FROM cache_entries")
+        with config.set(return_cache_entry=True):
+            cache_entry = cached_now("bar")
+        assert isinstance(cache_entry, database.CacheEntry)
+        assert cache_entry.counter == 2
+        assert len(list(store.local.iter_entries())) == 1
+
+    with config.set(
+        cache_db_urlpath=[config.get().cache_db_urlpath] * 2,
+        cache_db_local_path=local_path,
+    ):
+        with pytest.raises(ValueError, match="requires a single"):
+            config.get().get_metadata_store("foo")